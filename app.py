@@ -1,21 +1,55 @@
+import time
+
+# app startup is timed from here, so the breakdown includes imports
+_startup_start = time.perf_counter()
+
 from flask import (
     Flask,
     render_template,
     request,
     Markup,
     json,
-    make_response,
+    jsonify,
+    Response,
     Blueprint,
+    session,
+    abort,
+    make_response,
+    g,
+    send_from_directory,
+    url_for,
 )
-from wtforms import Form, validators
+from werkzeug.exceptions import BadRequest
+from wtforms import Form, SelectField, validators
 from title_select import SelectMultipleField
-from census import CensusViewer, GeoDB
-from load_config import load_config
-
+from census import ROLLUP_TYPES, CensusViewer, GeoDB, UnknownGeography
+from census_cache import CensusCache
+import census_api
+from fetch_engine import FetchEngine
+from matrix_store import CountyMatrixStore
+from load_config import load_config_cached, seed_config_cache
+from snapshot import load_snapshot
+from compression import CompressionMiddleware, negotiate
+from build_static import DIST_DIR, MANIFEST_NAME
+from export import EXPORT_FORMATS, format_available
+from result_store import MemoryResultStore, SQLiteResultStore, query_key
+from upstream import CircuitBreaker, UpstreamGuard, shared_rate_limiter
+import metrics
+
+import hashlib
+import glob
+import logging
+import mimetypes
+import os
+import pathlib
 import secrets
 
 import chartkick
 
+metrics.record_startup_phase("imports", time.perf_counter() - _startup_start)
+
+logger = logging.getLogger(__name__)
+
 ck = Blueprint(
     "ck_page", __name__, static_folder=chartkick.js(), static_url_path="/static"
 )
@@ -23,13 +57,119 @@ ck = Blueprint(
 server = Flask(__name__)
 server.secret_key = secrets.app_secret
 
+# static and chartkick assets may be cached by browsers and proxies
+STATIC_MAX_AGE = 7 * 24 * 60 * 60
+server.config["SEND_FILE_MAX_AGE_DEFAULT"] = STATIC_MAX_AGE
+
 server.register_blueprint(ck, url_prefix="/ck")
 server.jinja_env.add_extension("chartkick.ext.charts")
 
+# assets built by build_static.py have content hashes in their names, so they 
+# can be cached forever
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+# compress dynamic responses. Built assets are served precompressed instead
+server.wsgi_app = CompressionMiddleware(server.wsgi_app, exclude_prefixes=("/assets/",))
+
+
+VARS_PATH = "vars.json"
+GEOS_PATH = "geos.db"
+# Validated vars.json and geos.db index written by `snapshot.py build`, used if 
+# present and both files are unchanged
+SNAPSHOT_PATH = "startup_snapshot.pickle"
+
+# Seconds before cached census api responses are re-downloaded. None: never
+CACHE_TTL = None
+# Census api download concurrency, shared by all requests in this process
+FETCH_WORKERS = 8
+FETCH_PER_HOST_LIMIT = 4
+# Answer only from census_cache.db (see warm_cache.py), never calling the census api
+OFFLINE = False
+# Census api source, and years offered by the year selector. Queries default
+# to the first year; selecting several compares them side by side
+CENSUS_SRC = "acs5"
+CENSUS_YEARS = (2018, 2017, 2016, 2015, 2014)
+# Name of the region made of all selected counties, when they're combined
+REGION_NAME = "Selected counties"
+# Memory mapped raw data written by `warm_cache.py --matrix`, used if present
+MATRIX_STORE_PATH = "county_matrix_acs5_2018"
+# Set to a file path to share query results between worker processes through
+# sqlite. None keeps results in a per-process LRU.
+RESULT_STORE_PATH = None
+RESULT_STORE_SIZE = 128
+# Seconds browsers and proxies may reuse query responses without revalidating
+RESULT_MAX_AGE = 24 * 60 * 60
+# County columns per /table-data page requested by the results table, and the 
+# most a client may request at once
+TABLE_PAGE_COLUMNS = 50
+MAX_PAGE_COLUMNS = 500
+# Add a Server-Timing header with per-stage timings to every response
+SERVER_TIMING = False
+# Census api calls per second (and largest burst) are UPSTREAM_RATE and
+# UPSTREAM_BURST in upstream.py, since warm_cache.py shares the limit
+# Seconds to wait for one census api call, and retries after a failed call
+UPSTREAM_TIMEOUT = 20
+UPSTREAM_RETRIES = 2
+# Consecutive failed calls before census api calls are paused (serving stale 
+# cached data where possible), and for how many seconds
+BREAKER_THRESHOLD = 5
+BREAKER_RESET = 30
+
+with metrics.startup_phase("snapshot"):
+    snapshot = load_snapshot(SNAPSHOT_PATH, VARS_PATH, GEOS_PATH)
+
+with metrics.startup_phase("geo_index"):
+    geoDB = GeoDB(GEOS_PATH, index=snapshot["geo_index"] if snapshot else None)
+
+with metrics.startup_phase("config"):
+    if snapshot:
+        seed_config_cache(VARS_PATH, snapshot["config"])
+    varsConfig = load_config_cached(VARS_PATH)
+
+with metrics.startup_phase("stores"):
+    censusCache = CensusCache("census_cache.db", ttl=CACHE_TTL)
+    fetchEngine = FetchEngine(
+        max_workers=FETCH_WORKERS, per_host_limit=FETCH_PER_HOST_LIMIT
+    )
+    census_api.configure(pool_size=FETCH_PER_HOST_LIMIT)
+    upstreamGuard = UpstreamGuard(
+        limiter=shared_rate_limiter(),
+        breaker=CircuitBreaker(
+            failure_threshold=BREAKER_THRESHOLD, reset_timeout=BREAKER_RESET
+        ),
+        timeout=UPSTREAM_TIMEOUT,
+        retries=UPSTREAM_RETRIES,
+    )
+    if RESULT_STORE_PATH is None:
+        resultStore = MemoryResultStore(max_entries=RESULT_STORE_SIZE)
+    else:
+        resultStore = SQLiteResultStore(
+            RESULT_STORE_PATH, max_entries=RESULT_STORE_SIZE
+        )
+    if os.path.isfile(MATRIX_STORE_PATH + ".json"):
+        matrixStore = CountyMatrixStore(MATRIX_STORE_PATH)
+    else:
+        matrixStore = None
+
+with metrics.startup_phase("viewer"):
+    censusViewer = CensusViewer(
+        geoDB=geoDB,
+        vars_config=varsConfig,
+        api_key=secrets.census_key,
+        cache=censusCache,
+        fetch_engine=fetchEngine,
+        offline=OFFLINE,
+        matrix_store=matrixStore,
+        upstream=upstreamGuard,
+    )
 
-geoDB = GeoDB("geos.db")
-censusViewer = CensusViewer(
-    geoDB=geoDB, vars_config=load_config("vars.json"), api_key=secrets.census_key
+metrics.record_startup_phase("total", time.perf_counter() - _startup_start)
+logger.info(
+    "started in %.0fms (%s snapshot): %s",
+    metrics.startup_phases()[-1][1] * 1000,
+    "with" if snapshot else "without",
+    ", ".join(
+        f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in metrics.startup_phases()
+    ),
 )
 
 
@@ -37,7 +177,7 @@ class StateForm(Form):
     geoSelector = SelectMultipleField(
         "Select Counties:",
         validators=[validators.DataRequired()],
-        choices=geoDB.get_all_counties(),
+        choices=(),
         render_kw={
             "class": "selectpicker",
             "multiple": "true",
@@ -47,13 +187,16 @@ class StateForm(Form):
             "data-selected-text-format": "count > 4",
             "data-size": "10",
             "data-done-button": "true",
+            # options are loaded from /api/counties as the user types
+            "data-live-search-placeholder": "Type a county or state",
+            "data-none-results-text": "No matching counties",
         },
     )
 
     varSelector = SelectMultipleField(
         "Select Variables to Display:",
         validators=[validators.DataRequired()],
-        choices=censusViewer.available_vars,
+        choices=(),
         render_kw={
             "class": "selectpicker",
             "multiple": "true",
@@ -63,8 +206,347 @@ class StateForm(Form):
         },
     )
 
+    yearSelector = SelectMultipleField(
+        "Select Years:",
+        choices=[(str(year), str(year)) for year in CENSUS_YEARS],
+        default=[str(CENSUS_YEARS[0])],
+        render_kw={
+            "class": "selectpicker",
+            "multiple": "true",
+            "data-selected-text-format": "count > 3",
+        },
+    )
+
+    geoType = SelectField(
+        "Show:",
+        choices=[
+            ("county", "Each county"),
+            ("state", "States of the selected counties"),
+            ("region", "Selected counties combined"),
+            ("nation", "United States"),
+        ],
+        default="county",
+        render_kw={"class": "selectpicker"},
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # choices are cached, and only rebuilt if vars.json or geos.db changed.
+        # Only selected counties are rendered; the rest are searched through 
+        # /api/counties
+        censusViewer.update_config(load_config_cached(VARS_PATH))
+        self.geoSelector.choices = geoDB.county_choices(self.geoSelector.data or ())
+        self.varSelector.choices = censusViewer.available_vars
+
+
+@server.before_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    metrics.start_request()
+
+
+@server.after_request
+def record_timing(response):
+    elapsed = time.perf_counter() - g.request_start
+    metrics.REQUEST_SECONDS.observe(
+        elapsed, request.endpoint or "", request.method, response.status_code
+    )
+
+    if SERVER_TIMING:
+        spans = metrics.request_spans() + [("total", elapsed)]
+        response.headers["Server-Timing"] = metrics.server_timing_header(spans)
+
+    return response
+
+
+@server.errorhandler(UnknownGeography)
+def unknown_geography(error):
+    '''
+    Selections naming counties or states that don't exist are bad requests.
+    '''
+    return BadRequest(description=str(error))
+
+
+@server.route("/metrics")
+def metrics_endpoint():
+    '''
+    Stage and request latency histograms for this process, in the Prometheus 
+    text format.
+    '''
+    return Response(
+        metrics.render_prometheus(), mimetype="text/plain; version=0.0.4"
+    )
+
+
+@server.route("/api/counties")
+def county_search():
+    '''
+    County typeahead for the county selector. Returns up to `limit` (default 
+    20, at most 100) "county, state" labels matching the `q` query parameter, 
+    best first:
+        {"q": "alle penn", "counties": ["Allegheny County, Pennsylvania"]}
+    '''
+    query = request.args.get("q", "")
+    limit = min(max(request.args.get("limit", 20, type=int), 0), 100)
+
+    response = jsonify(q=query, counties=geoDB.search_counties(query, limit=limit))
+    response.cache_control.public = True
+    response.cache_control.max_age = RESULT_MAX_AGE
+    return response
+
+
+def load_asset_manifest():
+    '''
+    returns:
+        Dict[str: str]: source name -> built name of assets in static/dist, 
+            empty if build_static.py hasn't been run
+    '''
+    try:
+        with open(os.path.join(DIST_DIR, MANIFEST_NAME), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+assetManifest = load_asset_manifest()
+
+
+@server.context_processor
+def asset_helpers():
+    def asset_url(name):
+        '''
+        Url of a static asset: its fingerprinted build if there is one, the 
+        source file otherwise.
+        '''
+        built = assetManifest.get(name)
+        if built is None:
+            return url_for("static", filename=name)
+        return url_for("asset", filename=built)
+
+    return {"asset_url": asset_url}
+
+
+@server.route("/assets/<path:filename>")
+def asset(filename):
+    '''
+    Serves assets built by build_static.py, precompressed if the client 
+    accepts it, with immutable cache headers.
+    '''
+    extensions = {"br": ".br", "gzip": ".gz"}
+    encoding = negotiate(
+        request.headers.get("Accept-Encoding"),
+        [
+            encoding
+            for encoding, extension in extensions.items()
+            if os.path.isfile(os.path.join(DIST_DIR, filename + extension))
+        ],
+    )
+
+    response = send_from_directory(
+        DIST_DIR,
+        filename + extensions[encoding] if encoding else filename,
+        mimetype=mimetypes.guess_type(filename)[0],
+        max_age=ASSET_MAX_AGE,
+    )
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+# changes whenever templates or built assets change, so cached pages aren't 
+# reused across releases
+TEMPLATES_VERSION = hashlib.sha256(
+    b"".join(
+        pathlib.Path(path).read_bytes()
+        for path in sorted(glob.glob("templates/*.html"))
+    )
+    + json.dumps(assetManifest, sort_keys=True).encode("utf-8")
+).hexdigest()[:16]
+
+
+def result_key(selected_counties, selected_vars, selected_years, geo_type):
+    '''
+    Result store key of a query, for the variable config currently loaded.
+    '''
+    return query_key(
+        selected_counties,
+        selected_vars,
+        CENSUS_SRC,
+        selected_years,
+        geo_type,
+        config_version=censusViewer.config_version,
+    )
+
+
+def query_etag(
+    selected_counties, selected_vars, selected_years, variant, geo_type="county"
+):
+    '''
+    Deterministic ETag for a response built from a query. Results for a fixed 
+    selection only change when vars.json or the templates do.
+
+    args:
+        variant (str): Distinguishes responses built from the same query, e.g. 
+            the dashboard page and a csv download
+    '''
+    key = result_key(selected_counties, selected_vars, selected_years, geo_type)
+    return hashlib.sha256(
+        ":".join([key, TEMPLATES_VERSION, variant]).encode("utf-8")
+    ).hexdigest()[:32]
+
+
+def not_modified(etag):
+    '''
+    Returns a 304 response if the request's If-None-Match matches etag, None 
+    otherwise. Checked before building a response, so matching requests don't 
+    query any census data.
+    '''
+    # weak comparison, since compressed responses carry weak ETags
+    if request.if_none_match.contains_weak(etag):
+        return cacheable(Response(status=304), etag)
+    return None
+
+
+def cacheable(response, etag):
+    '''
+    Adds validators and Cache-Control to a query response. Responses to POSTs, 
+    and responses that set the session cookie, are only for the user who made 
+    the request, so shared caches must not keep them.
+    '''
+    response.set_etag(etag)
+    if request.method == "POST" or session.modified:
+        response.cache_control.private = True
+        response.cache_control.no_store = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = RESULT_MAX_AGE
+    return response
+
+
+def parse_selection(form):
+    '''
+    Reads selected counties, variables, years and geography type from a 
+    submitted StateForm.
+
+    returns:
+        (List[List[str, str]], List[str], List[int], str): state, county name 
+            pairs, selected variable ids, selected years (CENSUS_YEARS[0] if 
+            none are), and "county" or one of census.ROLLUP_TYPES
+    raises:
+        werkzeug.exceptions.BadRequest: if a selected variable isn't in the 
+            current config, or a selected year isn't one of CENSUS_YEARS
+    '''
+    labels = [county.split(",") for county in form.geoSelector.data]
+    for label in labels:
+        if len(label) != 2:
+            abort(400, description=f"County '{','.join(label)}' does not exist")
+    selected_counties = [[state.strip(), county] for county, state in labels]
+
+    var_ids = {str(var["id"]) for var in censusViewer.vars_config}
+    for var in form.varSelector.data:
+        if var not in var_ids:
+            abort(400, description=f"Variable '{var}' does not exist")
+    selected_vars = [var for var in form.varSelector.data]
+
+    offered_years = {str(year): year for year in CENSUS_YEARS}
+    for year in form.yearSelector.data:
+        if year not in offered_years:
+            abort(400, description=f"Year '{year}' is not available")
+    selected_years = [
+        offered_years[year] for year in form.yearSelector.data
+    ] or [CENSUS_YEARS[0]]
+
+    geo_type = form.geoType.data if form.geoType.data in ROLLUP_TYPES else "county"
 
-data2 = None
+    return selected_counties, selected_vars, selected_years, geo_type
+
+
+def rollup_geos(selected_counties, geo_type):
+    '''
+    Geographies the selected counties are rolled up into, in the format 
+    expected by CensusViewer.query_rollup: their states, a single region made 
+    of all of them, or the nation.
+    '''
+    if geo_type == "state":
+        return list(dict.fromkeys(state for state, _ in selected_counties))
+    if geo_type == "region":
+        return [(REGION_NAME, selected_counties)]
+    return []
+
+
+def get_result(selected_counties, selected_vars, selected_years, geo_type):
+    '''
+    Returns the result of a query, from the result store if it was already 
+    computed, and stores it otherwise. Census downloads for identical queries 
+    running at the same time are shared (see FetchEngine.submit_shared). All 
+    selected years are downloaded together (see CensusViewer.query). States, 
+    regions and the nation are summed from county data (see 
+    CensusViewer.query_rollup).
+
+    returns:
+        (str, census.QueryResult): result key, and result
+    '''
+    key = result_key(selected_counties, selected_vars, selected_years, geo_type)
+
+    result = resultStore.get(key)
+    if result is None:
+        if geo_type == "county":
+            result = censusViewer.query(
+                selected_counties, selected_vars, src=CENSUS_SRC, year=selected_years
+            )
+        else:
+            result = censusViewer.query_rollup(
+                rollup_geos(selected_counties, geo_type),
+                selected_vars,
+                geo_type=geo_type,
+                src=CENSUS_SRC,
+                year=selected_years,
+            )
+        # the dataframe is built before storing, so the store never holds a 
+        # result that still has to query census data
+        result.df
+        resultStore.put(key, result)
+
+    return key, result
+
+
+def selection_fields(selected_counties, selected_vars, selected_years, geo_type):
+    '''
+    StateForm fields for a selection, as read by parse_selection. Pages send 
+    them back to /table-data and /chart-data, which recompute results their 
+    worker doesn't have stored.
+    '''
+    return {
+        "geoSelector": [f"{county}, {state}" for state, county in selected_counties],
+        "varSelector": list(selected_vars),
+        "yearSelector": [str(year) for year in selected_years],
+        "geoType": geo_type,
+    }
+
+
+def stored_result(key):
+    '''
+    Returns the result stored under key. The store only keeps recent results, 
+    by default only in the worker process that computed them, so on a miss the 
+    result is recomputed from the selection POSTed with the request (see 
+    selection_fields), as long as it still has the same key.
+
+    raises:
+        werkzeug.exceptions.NotFound: if the result isn't stored and can't be 
+            recomputed
+    '''
+    result = resultStore.get(key)
+    if result is None and request.method == "POST":
+        selection = parse_selection(StateForm(request.form))
+        if selection[0] and result_key(*selection) == key:
+            _, result = get_result(*selection)
+    if result is None:
+        abort(404)
+    return result
 
 
 @server.route("/", methods=["GET", "POST"])
@@ -72,15 +554,26 @@ def dashboard():
     '''
     Main dashboard view. Includes forms for selecting geographies (counties) and 
     variables to display.
+
+    The form POSTs its selection, since a selection of many counties doesn't 
+    fit in a url. Selections passed as query parameters are accepted too, so a 
+    small selection can be linked to, and cached and revalidated with its ETag.
     '''
-    form = StateForm(request.form)
+    form = StateForm(request.values)
 
-    selected_counties = [
-        [state.strip(), county]
-        for county, state in [county.split(",") for county in form.geoSelector.data]
-    ]
+    (
+        selected_counties,
+        selected_vars,
+        selected_years,
+        geo_type,
+    ) = parse_selection(form)
 
-    selected_vars = [var for var in form.varSelector.data]
+    etag = query_etag(
+        selected_counties, selected_vars, selected_years, "dashboard", geo_type
+    )
+    response = not_modified(etag)
+    if response is not None:
+        return response
 
     if not selected_counties:
         categories = [""]
@@ -89,33 +582,46 @@ def dashboard():
         # race_data = {}
         # emp_data = {}
         # sex_data = {}
+        rendered_table = render_output_table(categories, colnames, formatted_data)
     else:
-        formatted_data, colnames = censusViewer.view_dict(
-            county_names=selected_counties, selected_var_ids=selected_vars
+        key, result = get_result(
+            selected_counties, selected_vars, selected_years, geo_type
         )
-        categories = list(formatted_data.keys())
-        global data2
-        data2 = censusViewer.view_df(selected_counties, selected_vars)
+        if request.method == "POST":
+            # GET urls carry the selection themselves; keeping the session 
+            # untouched lets proxies cache them
+            session["result_key"] = key
         # race_data = formatted_data["Race"]
         # emp_data = formatted_data["Employment Status"]
         # sex_data = formatted_data["Sex by age"]
         # del sex_data[0]
         # del race_data[0]
-    rendered_table = render_output_table(categories, colnames, formatted_data)
-
-    print(form.errors)
+        rendered_table = render_results_table(
+            key,
+            result,
+            selection_fields(
+                selected_counties, selected_vars, selected_years, geo_type
+            ),
+        )
 
-    return render_template(
-        "state.html",
-        form=form,
-        rendered_table=rendered_table,
-        data_available=True if selected_counties else False,
-        # race_data=race_data,
-        # emp_data=emp_data,
-        # sex_data=sex_data,
+    if form.errors:
+        server.logger.debug("dashboard form errors: %s", form.errors)
+
+    response = make_response(
+        render_template(
+            "state.html",
+            form=form,
+            rendered_table=rendered_table,
+            data_available=True if selected_counties else False,
+            # race_data=race_data,
+            # emp_data=emp_data,
+            # sex_data=sex_data,
+        )
     )
+    return cacheable(response, etag)
 
 
+@metrics.timed("render_table")
 def render_output_table(categories, column_names, rows):
     '''
     Helper function that renders selected data in HTML.
@@ -145,70 +651,177 @@ def render_output_table(categories, column_names, rows):
     return Markup(rendered)
 
 
-@server.route("/download-data", methods=["POST"])
+@metrics.timed("render_table")
+def render_results_table(key, result, selection):
+    '''
+    Renders a virtualized results table. Only the table's frame is rendered 
+    here; the browser fetches cells from /table-data, one category and window 
+    of county columns at a time (see static/results_table.js).
+
+    Args:
+        key (str): result key
+        result (census.QueryResult): query result
+        selection (Dict): the query's selection, from selection_fields
+    '''
+    rendered = render_template(
+        "results_table.html",
+        key=key,
+        selection=selection,
+        categories=result.categories,
+        column_count=len(result.colnames) - 1,
+        page_columns=TABLE_PAGE_COLUMNS,
+    )
+
+    return Markup(rendered)
+
+
+@server.route("/download-data", methods=["GET", "POST"])
 def return_download():
     '''
-    Endpoint for downloading csv containing selected data
+    Endpoint for downloading selected data. Output is streamed in chunks of rows.
+
+    The format query parameter selects the file format: csv (default), jsonl, 
+    arrow (Arrow IPC stream) or parquet. arrow and parquet require pyarrow.
     '''
-    form = StateForm(request.form)
+    form = StateForm(request.values)
 
-    selected_counties = [
-        [state.strip(), county]
-        for county, state in [county.split(",") for county in form.geoSelector.data]
-    ]
+    (
+        selected_counties,
+        selected_vars,
+        selected_years,
+        geo_type,
+    ) = parse_selection(form)
 
-    selected_vars = [var for var in form.varSelector.data]
+    fmt = request.args.get("format", "csv")
+    if not format_available(fmt):
+        abort(400, description=f"Export format '{fmt}' is not available")
 
-    data = censusViewer.view_df(selected_counties, selected_vars)
-    response = make_response(data.to_csv(index=False))
-    response.headers["Content-Disposition"] = "attachment; filename=county_acs_data.csv"
-    response.headers["Content-Type"] = "text/csv"
+    etag = query_etag(
+        selected_counties, selected_vars, selected_years, f"download:{fmt}", geo_type
+    )
+    response = not_modified(etag)
+    if response is not None:
+        return response
 
-    return response
+    iter_export, mimetype, extension = EXPORT_FORMATS[fmt]
+
+    _, result = get_result(
+        selected_counties, selected_vars, selected_years, geo_type
+    )
+    # export generators only read the built dataframe, so they don't need the 
+    # request context while streaming
+    response = Response(iter_export(result.df), mimetype=mimetype)
+    response.headers[
+        "Content-Disposition"
+    ] = f"attachment; filename=county_acs_data.{extension}"
+
+    return cacheable(response, etag)
 
 
-@server.route("/chart", methods=["POST"])
+@server.route("/chart", methods=["GET", "POST"])
 def render_chart():
-    global data2
-    form = StateForm(request.form)
+    '''
+    Chart page. Renders one placeholder per county and category; chart data is 
+    fetched by the browser from /chart-data.
+    '''
+    form = StateForm(request.values)
+
+    (
+        selected_counties,
+        selected_vars,
+        selected_years,
+        geo_type,
+    ) = parse_selection(form)
+
+    if selected_counties:
+        etag = query_etag(
+            selected_counties, selected_vars, selected_years, "chart", geo_type
+        )
+        response = not_modified(etag)
+        if response is not None:
+            return response
 
-    selected_counties = [
-        [state.strip(), county]
-        for county, state in [county.split(",") for county in form.geoSelector.data]
-    ]
+        key, result = get_result(
+            selected_counties, selected_vars, selected_years, geo_type
+        )
+        selection = selection_fields(
+            selected_counties, selected_vars, selected_years, geo_type
+        )
+    else:
+        # fall back to the last result shown on the dashboard in this session
+        key = session.get("result_key")
+        result = resultStore.get(key)
+        if result is None:
+            abort(400)
+        selection = None
+
+    response = make_response(
+        render_template(
+            "chart.html",
+            key=key,
+            selection=selection,
+            counties=result.colnames[1:],
+            categories=result.categories,
+        )
+    )
 
-    selected_vars = [var for var in form.varSelector.data]
+    if selected_counties:
+        return cacheable(response, etag)
+    return response
 
-    all_charts = {}
 
-    for i in data2.columns:
-        if i == "name" or i == "category":
-            continue
+@server.route("/chart-data/<key>", methods=["GET", "POST"])
+def chart_data(key):
+    '''
+    Chartkick series for a stored result, as json:
+        {county name: {category: [{variable name: value, ...}]}}
 
-        cat = data2[i].groupby(data2["category"])
-        l_graph_dict = {}
+    GETs answer 404 if the result isn't stored; POSTing the result's selection 
+    recomputes it instead (see stored_result).
+    '''
+    etag = f"{key}-{censusViewer.config_version}"
+    response = not_modified(etag)
+    if response is not None:
+        return response
 
-        for c in cat:
-            l_graph = []
-            category = ""
-            for index, row in enumerate(c):
+    result = stored_result(key)
 
-                if index == 0:
-                    category = str(row)
-                else:
-                    graph_dict = {}
-                    for ii, v in row.items():
-                        graph_dict[str(data2.loc[ii, "name"])] = v
-                    l_graph.append(graph_dict)
-            l_graph_dict[category] = l_graph
-        all_charts[i] = l_graph_dict
+    return cacheable(jsonify(result.chart_data), etag)
 
-    return render_template(
-        "chart.html",
-        all_charts=all_charts,
+
+@server.route("/table-data/<key>", methods=["GET", "POST"])
+def table_data(key):
+    '''
+    One page of a stored result's table, as columnar json: the rows of one 
+    category, for a range of county columns. Query parameters are category, 
+    col_start (default 0) and col_count (default TABLE_PAGE_COLUMNS, at most 
+    MAX_PAGE_COLUMNS). See CensusViewer._build_table_page for the format.
+
+    GETs answer 404 if the result isn't stored; POSTing the result's selection 
+    recomputes it instead (see stored_result).
+    '''
+    category = request.args.get("category", "")
+    col_start = max(request.args.get("col_start", 0, type=int), 0)
+    col_count = min(
+        max(request.args.get("col_count", TABLE_PAGE_COLUMNS, type=int), 1),
+        MAX_PAGE_COLUMNS,
     )
 
+    etag = hashlib.sha256(
+        ":".join(
+            [key, censusViewer.config_version, category, str(col_start), str(col_count)]
+        ).encode("utf-8")
+    ).hexdigest()[:32]
+    response = not_modified(etag)
+    if response is not None:
+        return response
 
+    result = stored_result(key)
+
+    return cacheable(
+        jsonify(result.table_page(category, col_start=col_start, col_count=col_count)),
+        etag,
+    )
 
 
 if __name__ == "__main__":
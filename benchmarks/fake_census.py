@@ -0,0 +1,90 @@
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import censusdata
+
+import census_api
+
+
+class FakeCensusAPI:
+    """
+    Local stand-in for census_api.download. Serves deterministic synthetic data
+    with the same shape as real responses: one row per county in the requested
+    state (or in every state), indexed by censusgeo, one column per variable.
+
+    args:
+        geo_db_path (str): geos.db, used for real state and county names/fips
+        latency (float): Seconds each download sleeps, to mimic the api round trip
+    """
+
+    def __init__(self, geo_db_path, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+        db = sqlite3.connect(geo_db_path)
+        states = dict(db.execute("SELECT state, state_fips FROM states").fetchall())
+        self._counties = {}
+        for state, county, county_fips in db.execute(
+            "SELECT state, county, county_fips FROM counties ORDER BY state, county"
+        ):
+            self._counties.setdefault(states[state], []).append(
+                censusdata.censusgeo(
+                    [("state", states[state]), ("county", county_fips)],
+                    f"{county}, {state}",
+                )
+            )
+        db.close()
+
+        # rows of each state within the national ordering, so per-state and
+        # national responses agree
+        self._all_counties = []
+        self._positions = {}
+        for fips, counties in self._counties.items():
+            start = len(self._all_counties)
+            self._all_counties += counties
+            self._positions[fips] = np.arange(start, len(self._all_counties))
+
+    def _values(self, src, year, var_id, tabletype):
+        rng = np.random.default_rng(zlib.crc32(f"{src}{year}{var_id}".encode()))
+        values = rng.integers(0, 1_000_000, size=len(self._all_counties))
+        # subject and profile tables are mostly percentages
+        return values / 10000 if tabletype != "detail" else values
+
+    def download(self, src, year, geo, var, key=None, tabletype="detail", timeout=None):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        state_fips = dict(geo.params())["state"]
+        if state_fips == "*":
+            index = self._all_counties
+            positions = slice(None)
+        else:
+            index = self._counties[state_fips]
+            positions = self._positions[state_fips]
+
+        data = {
+            var_id: self._values(src, year, var_id, tabletype)[positions]
+            for var_id in var
+        }
+        return pd.DataFrame(data, index=index)
+
+
+@contextmanager
+def patched(api):
+    """
+    Replaces census_api.download with api.download while active.
+    """
+    original = census_api.download
+    census_api.download = api.download
+    try:
+        yield api
+    finally:
+        census_api.download = original
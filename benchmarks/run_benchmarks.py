@@ -0,0 +1,253 @@
+"""
+    Offline benchmarks for the query hot paths.
+
+    Census api calls are served by FakeCensusAPI, so no network access or api key
+    is needed. Each scenario runs CensusViewer.view_dict, CensusViewer.view_df, or
+    the dashboard route (through the Flask test client) for a number of counties
+    and variables, against a cold or warm census cache, and reports throughput,
+    p50/p99 latency, peak traced memory and upstream calls per run.
+
+    Run from anywhere:
+
+        python benchmarks/run_benchmarks.py --latency 0.05
+        python benchmarks/run_benchmarks.py --save-baseline
+        python benchmarks/run_benchmarks.py --compare --tolerance 0.25
+
+    --compare exits with status 1 if any scenario's p50 latency regressed by more
+    than the tolerance relative to the saved baseline.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import product
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from benchmarks.fake_census import FakeCensusAPI, patched  # noqa: E402
+from census import CensusViewer, GeoDB  # noqa: E402
+from census_cache import CensusCache  # noqa: E402
+from fetch_engine import FetchEngine  # noqa: E402
+from load_config import load_config  # noqa: E402
+from result_store import MemoryResultStore  # noqa: E402
+
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+COUNTY_COUNTS = (1, 50, 3220)
+VAR_COUNTS = (1, 20, 176)
+CACHE_STATES = ("cold", "warm")
+TARGETS = ("view_dict", "view_df", "route")
+
+
+def pick_counties(geo_db, n):
+    """
+    Picks n counties spread evenly over all states.
+    """
+    all_counties = [
+        [state, county]
+        for state in sorted(geo_db.get_states())
+        for county in geo_db.get_state_counties(state)
+    ]
+    step = max(len(all_counties) // n, 1)
+    return all_counties[::step][:n]
+
+
+def pick_vars(viewer, n):
+    ids = [str(var["id"]) for var in viewer.vars_config]
+    step = max(len(ids) // n, 1)
+    return ids[::step][:n]
+
+
+class Scenario:
+    def __init__(self, target, n_counties, n_vars, cache_state):
+        self.target = target
+        self.n_counties = n_counties
+        self.n_vars = n_vars
+        self.cache_state = cache_state
+
+    @property
+    def name(self):
+        return (
+            f"{self.target}/{self.n_counties}c/{self.n_vars}v/{self.cache_state}"
+        )
+
+
+class Harness:
+    """
+    Holds a viewer (and optionally the Flask app) wired to a temporary census
+    cache, so benchmarks never touch census_cache.db.
+    """
+
+    def __init__(self, tmpdir, with_app):
+        self.cache = CensusCache(os.path.join(tmpdir, "bench_cache.db"))
+        self.geo_db = GeoDB("geos.db")
+        self.viewer = CensusViewer(
+            self.geo_db,
+            load_config("vars.json"),
+            api_key="",
+            cache=self.cache,
+            fetch_engine=FetchEngine(),
+        )
+
+        self.app = None
+        if with_app:
+            import app
+
+            app.censusViewer.cache = self.cache
+            app.censusViewer.matrix_store = None
+            # the app's shared census api rate limit would throttle the fake api
+            app.censusViewer.upstream = self.viewer.upstream
+            self.app = app
+            self.client = app.server.test_client()
+
+    def reset(self, cache_state):
+        if cache_state == "cold":
+            self.cache.clear()
+            self.viewer.clear_memo()
+            if self.app is not None:
+                self.app.censusViewer.clear_memo()
+        if self.app is not None:
+            self.app.resultStore = MemoryResultStore()
+
+    def run(self, scenario, counties, var_ids):
+        if scenario.target == "view_dict":
+            self.viewer.view_dict(counties, var_ids)
+        elif scenario.target == "view_df":
+            self.viewer.view_df(counties, var_ids)
+        else:
+            response = self.client.post(
+                "/",
+                data={
+                    "geoSelector": [f"{county}, {state}" for state, county in counties],
+                    "varSelector": var_ids,
+                },
+            )
+            assert response.status_code == 200, response.status_code
+            response.get_data()
+
+
+def run_scenario(harness, api, scenario, repeat):
+    counties = pick_counties(harness.geo_db, scenario.n_counties)
+    var_ids = pick_vars(harness.viewer, scenario.n_vars)
+
+    if scenario.cache_state == "warm":
+        harness.reset("cold")
+        harness.run(scenario, counties, var_ids)
+
+    timings = []
+    calls_before = api.calls
+    for _ in range(repeat):
+        harness.reset(scenario.cache_state)
+        start = time.perf_counter()
+        harness.run(scenario, counties, var_ids)
+        timings.append(time.perf_counter() - start)
+    calls = (api.calls - calls_before) / repeat
+
+    # memory is measured on a separate run, since tracing slows everything down
+    harness.reset(scenario.cache_state)
+    tracemalloc.start()
+    harness.run(scenario, counties, var_ids)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "p50": statistics.median(timings),
+        "p99": timings[min(len(timings) - 1, int(round(0.99 * (len(timings) - 1))))],
+        "throughput": len(timings) / sum(timings),
+        "peak_mb": peak / 2 ** 20,
+        "upstream_calls": calls,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    returns:
+        List[str]: descriptions of scenarios whose p50 regressed
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["p50"]
+        if result["p50"] > before * (1 + tolerance):
+            regressions.append(
+                f"{name}: p50 {before * 1000:.1f}ms -> {result['p50'] * 1000:.1f}ms"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1].strip())
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--quick", action="store_true", help="Skip the 3220 county scenarios"
+    )
+    parser.add_argument(
+        "--filter", default="", help="Only run scenarios whose name contains this"
+    )
+    parser.add_argument("--targets", nargs="+", default=TARGETS, choices=TARGETS)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    county_counts = [n for n in COUNTY_COUNTS if not (args.quick and n > 1000)]
+    scenarios = [
+        Scenario(*params)
+        for params in product(args.targets, county_counts, VAR_COUNTS, CACHE_STATES)
+    ]
+    scenarios = [s for s in scenarios if args.filter in s.name]
+
+    api = FakeCensusAPI("geos.db", latency=args.latency)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmpdir, patched(api):
+        harness = Harness(tmpdir, with_app="route" in args.targets)
+
+        print(
+            f"{'scenario':<32} {'p50 ms':>9} {'p99 ms':>9} {'ops/s':>8} "
+            f"{'peak MB':>8} {'calls':>6}"
+        )
+        for scenario in scenarios:
+            result = run_scenario(harness, api, scenario, args.repeat)
+            results[scenario.name] = result
+            print(
+                f"{scenario.name:<32} {result['p50'] * 1000:>9.1f} "
+                f"{result['p99'] * 1000:>9.1f} {result['throughput']:>8.2f} "
+                f"{result['peak_mb']:>8.1f} {result['upstream_calls']:>6.1f}"
+            )
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.isfile(BASELINE_PATH):
+            with open(BASELINE_PATH, "r") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {BASELINE_PATH}")
+
+    if args.compare:
+        if not os.path.isfile(BASELINE_PATH):
+            sys.exit(f"No baseline at {BASELINE_PATH}. Run with --save-baseline.")
+        with open(BASELINE_PATH, "r") as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions:")
+            print("\n".join(regressions))
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
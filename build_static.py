@@ -0,0 +1,167 @@
+"""
+    Builds fingerprinted static assets into static/dist, to be served with
+    immutable cache headers from /assets.
+
+    Every css and js file in static/ is minified (if rcssmin / rjsmin are
+    installed), written under a name containing a hash of its content, and
+    precompressed to .gz (and .br if brotli is installed). The banner is
+    resized and converted to WebP if Pillow is installed, and stylesheets are
+    rewritten to point at it. static/dist/manifest.json maps source names to
+    built names; templates look assets up with asset_url().
+
+        python3 build_static.py
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+SOURCE_DIR = "static"
+DIST_DIR = os.path.join(SOURCE_DIR, "dist")
+MANIFEST_NAME = "manifest.json"
+
+BANNER = "banner.png"
+# the banner is shown at full page width
+BANNER_WIDTH = 1920
+BANNER_WEBP_QUALITY = 80
+
+COMPRESSED_EXTENSIONS = (".css", ".js", ".svg")
+
+
+def minify(name, text):
+    """
+    Minifies css or js source, if the minifier for it is installed.
+    """
+
+    try:
+        if name.endswith(".js"):
+            from rjsmin import jsmin
+
+            return jsmin(text)
+        if name.endswith(".css"):
+            from rcssmin import cssmin
+
+            return cssmin(text)
+    except ImportError:
+        pass
+    return text
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def hashed_name(name, data):
+    stem, extension = os.path.splitext(name)
+    return f"{stem}.{content_hash(data)}{extension}"
+
+
+def write_asset(name, data, manifest):
+    """
+    Writes an asset under its hashed name, with precompressed copies.
+    """
+
+    built = hashed_name(name, data)
+    path = os.path.join(DIST_DIR, built)
+    with open(path, "wb") as f:
+        f.write(data)
+
+    if name.endswith(COMPRESSED_EXTENSIONS):
+        # mtime=0 keeps builds of the same content byte for byte identical
+        with open(path + ".gz", "wb") as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        try:
+            import brotli
+        except ImportError:
+            pass
+        else:
+            with open(path + ".br", "wb") as f:
+                f.write(brotli.compress(data, quality=11))
+
+    manifest[name] = built
+    return built
+
+
+def build_banner(manifest):
+    """
+    Writes the banner, as a resized WebP if Pillow is installed, or as is.
+
+    returns:
+        str: built name
+    """
+
+    source = os.path.join(SOURCE_DIR, BANNER)
+    try:
+        from PIL import Image
+    except ImportError:
+        with open(source, "rb") as f:
+            return write_asset(BANNER, f.read(), manifest)
+
+    import io
+
+    with Image.open(source) as image:
+        if image.width > BANNER_WIDTH:
+            height = round(image.height * BANNER_WIDTH / image.width)
+            image = image.resize((BANNER_WIDTH, height), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, "WEBP", quality=BANNER_WEBP_QUALITY, method=6)
+
+    built = write_asset("banner.webp", out.getvalue(), manifest)
+    # stylesheets refer to the source name
+    manifest[BANNER] = built
+    return built
+
+
+def rewrite_urls(css, manifest):
+    """
+    Points url() references to other assets at their built names.
+    """
+
+    def replace(match):
+        quote, name = match.group(1), match.group(2)
+        return f"url({quote}{manifest.get(name, name)}{quote})"
+
+    return re.sub(r"""url\((['"]?)([^'")]+)\1\)""", replace, css)
+
+
+def build(source_dir=SOURCE_DIR, dist_dir=DIST_DIR):
+    """
+    returns:
+        Dict[str: str]: manifest of source name -> built name
+    """
+
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    os.makedirs(dist_dir)
+
+    manifest = {}
+    build_banner(manifest)
+
+    for name in sorted(os.listdir(source_dir)):
+        if not name.endswith((".css", ".js")):
+            continue
+        with open(os.path.join(source_dir, name), "r", encoding="utf-8") as f:
+            text = minify(name, f.read())
+        if name.endswith(".css"):
+            text = rewrite_urls(text, manifest)
+        write_asset(name, text.encode("utf-8"), manifest)
+
+    with open(os.path.join(dist_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+if __name__ == "__main__":
+    manifest = build()
+    for name, built in sorted(manifest.items()):
+        source = os.path.join(SOURCE_DIR, name)
+        before = os.path.getsize(source) if os.path.isfile(source) else None
+        after = os.path.getsize(os.path.join(DIST_DIR, built))
+        print(
+            f"{name:<20} -> {built:<32} "
+            + (f"{before / 1024:8.1f} KB -> " if before is not None else " " * 15)
+            + f"{after / 1024:8.1f} KB"
+        )
@@ -4,6 +4,16 @@ import censusdata
 from tqdm import tqdm
 
 
+def create_indexes(c):
+    '''
+    Indexes used by GeoDB's lookups on the state and county tables
+    '''
+    c.executescript('''
+        CREATE UNIQUE INDEX IF NOT EXISTS states_state ON STATES (state);
+        CREATE UNIQUE INDEX IF NOT EXISTS counties_state_county ON COUNTIES (state, county);
+    ''')
+
+
 def build_states_cache(db_name):
     
     conn = sqlite3.connect(db_name)
@@ -16,6 +26,8 @@ def build_states_cache(db_name):
         CREATE TABLE COUNTIES (state text, county text, county_fips text);
     ''')
 
+    create_indexes(c)
+
     states = censusdata.geographies(censusdata.censusgeo([('state', '*')]), 'acs5', 2018)
 
     for state, state_geo in states.items():
@@ -1,71 +1,212 @@
-from itertools import product
+import hashlib
+import json
+import logging
 import os
 import sqlite3
-from functools import reduce
-
-from multiprocessing import Pool
-import pandas as pd
-import plydata
-import censusdata
-
-DB = sqlite3.connect("geos.db")
-N_PROCESSES = 4
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import as_completed
+
+import numpy as np
+
+import census_api
+from census_cache import OfflineCacheMiss
+from county_search import CountySearchIndex
+from matrix_store import NATION_CODE, county_code, state_code
+from lazy import LazyModule
+from metrics import timed
+from definitions import compile_definitions
+from fetch_engine import FetchEngine
+from upstream import UpstreamError, UpstreamGuard
+
+# only needed to answer queries, so not imported at startup
+pd = LazyModule("pandas")
+censusdata = LazyModule("censusdata")
+
+# Fetch a tabletype with one national query instead of per-state queries once 
+# this many states are needed
+NATIONAL_FETCH_THRESHOLD = 10
+ALL_STATES = "*"
+
+# census api variable id prefix -> table type
+TABLETYPES = [
+    ("B", r"detail"),
+    ("S", r"subject"),
+    ("DP", r"profile"),
+    ("CP", r"cprofile"),
+]
+
+# geographies CensusViewer.query_rollup builds by summing county raw data
+ROLLUP_TYPES = ("state", "region", "nation")
+NATION_NAME = "United States"
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownGeography(ValueError):
+    """
+    Raised when a query names a state or county that isn't in the geography
+    database.
+    """
 
 
 class GeoDB:
-    def __init__(self, db_path):
+    def __init__(self, db_path, index=None):
+        """
+        args:
+            db_path (str): Path to geos.db
+            index (dict): In-memory index from GeoDB.export_index, e.g. loaded 
+                from a startup snapshot. The database is only read if not given.
+        """
 
         if os.path.isfile(db_path):
-            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db_path = db_path
+            self.db = None
         else:
             raise Exception(
                 f"""Database {db_path} not found. Try running cache_geos.py to populate database."""
             )
 
-    def get_states(self):
+        if index is None:
+            self._load_index()
+        else:
+            self._loaded_mtime = os.stat(self.db_path).st_mtime_ns
+            self._state_fips = index["state_fips"]
+            self._county_fips = index["county_fips"]
+            self._state_counties = index["state_counties"]
+            self._all_counties = index["all_counties"]
+            self._county_search = index.get("county_search")
+
+    def export_index(self):
         """
         returns:
-            list[str]: List of state names
+            dict: the in-memory index, including selector choices, which can be 
+                passed back to GeoDB()
+        """
+        return {
+            "state_fips": self._state_fips,
+            "county_fips": self._county_fips,
+            "state_counties": self._state_counties,
+            "all_counties": self.get_all_counties(),
+            "county_search": self.county_search,
+        }
+
+    def _load_index(self):
         """
+        Loads the states and counties tables into in-memory dicts, so fips
+        lookups don't need a database round trip.
+        """
+        self._loaded_mtime = os.stat(self.db_path).st_mtime_ns
+        self._all_counties = None
+        self._county_search = None
+
+        if self.db is None:
+            self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+
         cur = self.db.cursor()
+        cur.execute("SELECT state, state_fips FROM states")
+        self._state_fips = dict(cur.fetchall())
+
         cur.execute(
             """
-            SELECT state 
-            FROM states; 
+            SELECT state, county, county_fips
+            FROM counties
+            ORDER BY state, county
         """
         )
-
-        states = [state[0] for state in cur.fetchall()]
+        self._county_fips = {}
+        self._state_counties = {state: [] for state in self._state_fips}
+        for state, county, county_fips in cur.fetchall():
+            self._county_fips[(state, county)] = county_fips
+            self._state_counties.setdefault(state, []).append(county)
         cur.close()
-        return states
 
+    def get_states(self):
+        """
+        returns:
+            list[str]: List of state names
+        """
+        return list(self._state_fips)
+
+    @timed("geo_choices")
     def get_all_counties(self):
+        """
+        Builds the grouped (state, ((label, value), ...)) choices used by the
+        county selector. Built once and reused until geos.db changes on disk.
 
-        cur = self.db.cursor()
-        cur.execute("select state from states order by state")
-        states = [state[0] for state in cur.fetchall()]
-
-        stateslist = []
-        for state in states:
-            cur.execute(
-                """
-                    select county || ', ' || state 
-                    from counties 
-                    join states using (state)
-                    where state = "{state}"
-                    order by county
-                """.format(
-                    state=state
+        returns:
+            tuple: one (state, counties) pair per state, sorted by name
+        """
+
+        self.reload_if_changed()
+
+        if self._all_counties is None:
+            self._all_counties = tuple(
+                (
+                    state,
+                    tuple(
+                        (f"{county}, {state}", f"{county}, {state}")
+                        for county in self._state_counties[state]
+                    ),
                 )
+                for state in sorted(self._state_counties)
+            )
+
+        return self._all_counties
+
+    @property
+    def county_search(self):
+        """
+        county_search.CountySearchIndex over "county, state" labels, built on
+        first use unless it came with a snapshot.
+        """
+
+        self.reload_if_changed()
+
+        if self._county_search is None:
+            self._county_search = CountySearchIndex(
+                f"{county}, {state}"
+                for state in sorted(self._state_counties)
+                for county in self._state_counties[state]
             )
+        return self._county_search
 
-            counties = cur.fetchall()
+    @timed("county_search")
+    def search_counties(self, query, limit=20):
+        """
+        Typeahead search over counties.
 
-            counties_tuple = tuple((county[0], county[0]) for county in counties)
+        arguments:
+            query (str): text typed by the user, e.g. "alle penn"
+            limit (int): maximum number of matches
+        returns:
+            list[str]: "county, state" labels, best match first
+        """
+        return self.county_search.search(query, limit=limit)
 
-            stateslist.append(tuple([state, counties_tuple]))
+    def county_choices(self, labels):
+        """
+        Builds selector choices, grouped by state like get_all_counties, for
+        just the given "county, state" labels. Unknown labels are left out.
+        """
+
+        selected = set(labels)
+        choices = []
+        for state, counties in self.get_all_counties():
+            options = tuple(option for option in counties if option[0] in selected)
+            if options:
+                choices.append((state, options))
+        return tuple(choices)
+
+    def reload_if_changed(self):
+        """
+        Reloads the in-memory index if the database file was modified since it
+        was last loaded.
+        """
 
-        return tuple(stateslist)
+        if os.stat(self.db_path).st_mtime_ns != self._loaded_mtime:
+            self._load_index()
 
     def get_state_counties(self, state):
         """
@@ -77,19 +218,7 @@ class GeoDB:
             list[str]: List of county names
         """
 
-        cur = self.db.cursor()
-        cur.execute(
-            f"""
-            select county 
-            from counties 
-            where state == "{state}"
-        """
-        )
-
-        counties = [county[0] for county in cur.fetchall()]
-        cur.close()
-
-        return counties
+        return list(self._state_counties.get(state, []))
 
     def get_state_fips(self, state_name):
         """
@@ -101,19 +230,7 @@ class GeoDB:
             str: fips code of state
         """
 
-        cur = self.db.cursor()
-        cur.execute(
-            """
-            SELECT state_fips
-            FROM states
-            WHERE state == ? 
-        """,
-            (state_name,),
-        )
-
-        state_fips = cur.fetchall()[0][0]
-
-        return state_fips
+        return self._state_fips[state_name]
 
     def get_county_fips(self, state_name, county_name):
         """
@@ -125,76 +242,443 @@ class GeoDB:
         returns:
             str: fips code of county
         """
-        cur = self.db.cursor()
-        cur.execute(
-            """
-            SELECT county_fips
-            FROM counties
-            WHERE state == ? AND county == ?
-        """,
-            (state_name, county_name),
-        )
-        county_fips = cur.fetchall()[0][0]
 
-        return county_fips
+        return self._county_fips[(state_name, county_name)]
+
+    @timed("fips_lookup")
+    def resolve_many(self, geo_names):
+        """
+        Gets fips codes for many counties at once
+
+        arguments:
+            geo_names (list[tuple[str, str]]): List of state, county name pairs
+        returns:
+            list[tuple[str, str]]: List of state, county fips code pairs, in the
+                same order as geo_names
+        raises:
+            UnknownGeography: if a state, county pair isn't in the database
+        """
+
+        state_fips = self._state_fips
+        county_fips = self._county_fips
+        fips = []
+        for state, county in geo_names:
+            if (state, county) not in county_fips:
+                raise UnknownGeography(f"Unknown county '{county}, {state}'")
+            fips.append((state_fips[state], county_fips[(state, county)]))
+        return fips
+
+
+def _piece_codes(state_fips, index):
+    """
+    County codes (see matrix_store.county_code) of a raw data piece's rows. 
+    Pieces are indexed by censusgeo, like censusdata.download output, or 
+    already by county code.
+    """
+    if pd.api.types.is_integer_dtype(index):
+        return index
+    return pd.Index([county_code(state_fips, geo.params()[1][1]) for geo in index])
+
+
+def vintages(src="acs5", year=2018):
+    """
+    Normalizes the src and year of a query to a list of (src, year) pairs. Each
+    may be a single value or a list; every combination is queried, in order,
+    without duplicates.
+
+    returns:
+        List[Tuple[str, int]]
+    """
+
+    srcs = [src] if isinstance(src, str) else list(src)
+    years = [year] if isinstance(year, (int, str)) else list(year)
+    return list(dict.fromkeys((s, int(y)) for s in srcs for y in years))
+
+
+def county_labels(county_names):
+    """
+    "county, state" labels of state, county name pairs
+    """
+    return [f"{county}, {state}" for state, county in county_names]
+
+
+def vintage_labels(names, query_vintages):
+    """
+    Column names of a query's result: geography names (e.g. "county, state")
+    for single vintage queries, and "name (year)" or "name (src year)" for
+    queries spanning several years or sources, one per geography and vintage.
+
+    args:
+        names (List[str]): geography names
+        query_vintages (List[Tuple[str, int]]): (src, year) pairs
+    returns:
+        List[str]
+    """
+
+    if len(query_vintages) == 1:
+        return names
+
+    same_src = len(set(src for src, _ in query_vintages)) == 1
+    suffixes = [
+        str(year) if same_src else f"{src} {year}" for src, year in query_vintages
+    ]
+    return [f"{name} ({suffix})" for name in names for suffix in suffixes]
+
+
+class _RawDataMemo:
+    """
+    In-memory raw data from recent queries: one dataframe per (src, year, state 
+    fips, tabletype), indexed by county code, holding every variable fetched 
+    for it so far.
+
+    Queries are diffed against it per (state, tabletype, variable), so only 
+    variables it doesn't hold are read from the census cache or downloaded, and 
+    those are spliced into the existing dataframe. Selecting fewer variables or 
+    counties than an earlier query is answered from memory alone.
+
+    args:
+        max_columns (int): Maximum number of (state, variable) columns held. 
+            Least recently used pieces are dropped first.
+        ttl (float): Seconds a piece stays valid, normally the census cache's 
+            ttl. None means pieces never expire.
+    """
+
+    def __init__(self, max_columns=20000, ttl=None):
+        self.max_columns = max_columns
+        self.ttl = ttl
+
+        # key -> (created_at, dataframe). Dataframes are replaced, never 
+        # modified, so readers don't need the lock.
+        self._pieces = OrderedDict()
+        self._n_columns = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, var_ids):
+        """
+        returns:
+            (Pandas.DataFrame, List[str]): held columns of var_ids (None if 
+            there are none), and variable ids that aren't held
+        """
+
+        with self._lock:
+            entry = self._pieces.get(key)
+            if entry is None:
+                return None, var_ids
+            if self.ttl is not None and time.time() - entry[0] >= self.ttl:
+                self._drop(key)
+                return None, var_ids
+            self._pieces.move_to_end(key)
+
+        df = entry[1]
+        held = [var for var in var_ids if var in df.columns]
+        missing = [var for var in var_ids if var not in df.columns]
+        return (df[held] if held else None), missing
+
+    def put(self, key, state_fips, state_df):
+        """
+        Splices a raw data piece's columns into the held piece for key.
+        """
+
+        state_df = state_df.set_axis(_piece_codes(state_fips, state_df.index))
+
+        with self._lock:
+            entry = self._pieces.get(key)
+            if entry is None:
+                created_at, df = time.time(), state_df
+            else:
+                created_at, df = entry
+                new_vars = [var for var in state_df.columns if var not in df.columns]
+                if not new_vars:
+                    return
+                df = pd.concat([df, state_df[new_vars]], axis=1)
+                self._drop(key)
+
+            self._pieces[key] = (created_at, df)
+            self._n_columns += len(df.columns)
+
+            while self._n_columns > self.max_columns and len(self._pieces) > 1:
+                self._drop(next(iter(self._pieces)))
+
+    def _drop(self, key):
+        _, df = self._pieces.pop(key)
+        self._n_columns -= len(df.columns)
+
+    def clear(self):
+        with self._lock:
+            self._pieces.clear()
+            self._n_columns = 0
+
+
+class _RawDataAssembly:
+    """
+    Raw data for a query, filled in place one (state, tabletype) piece at a
+    time as census api results arrive.
+
+    args:
+        county_codes (List[int]): selected counties (see matrix_store.county_code)
+        var_ids (List[str]): census api variable ids
+    """
+
+    def __init__(self, county_codes, var_ids):
+        self.var_ids = var_ids
+        self.values = np.full((len(county_codes), len(var_ids)), np.nan)
+        self._columns = {var: j for j, var in enumerate(var_ids)}
+        self._rows = pd.Index(county_codes)
+        self._integer_vars = set()
+
+    @timed("assembly")
+    def fill(self, state_fips, state_df):
+        """
+        Copies a census api result for one state into the selected rows.
+        """
+
+        piece_codes = _piece_codes(state_fips, state_df.index)
+        rows = np.flatnonzero(self._rows.isin(piece_codes))
+        if not len(rows):
+            return
+
+        piece_rows = piece_codes.get_indexer(self._rows[rows])
+        columns = [self._columns[var] for var in state_df.columns]
+        self.values[np.ix_(rows, columns)] = state_df.to_numpy(dtype=np.float64)[
+            piece_rows
+        ]
+
+        self._integer_vars.update(state_df.select_dtypes("integer").columns)
+
+    def to_dataframe(self, index):
+        df = pd.DataFrame(self.values, index=index, columns=self.var_ids)
+        df.index.name = "county"
+        # restore integer columns, unless some counties are missing values
+        missing = np.isnan(self.values).any(axis=0)
+        integer_vars = [
+            var for var in self._integer_vars if not missing[self._columns[var]]
+        ]
+        if integer_vars:
+            df = df.astype(dict.fromkeys(integer_vars, np.int64))
+        return df
 
 
 class CensusViewer:
-    def __init__(self, geoDB, vars_config, api_key):
+    def __init__(
+        self,
+        geoDB,
+        vars_config,
+        api_key,
+        cache=None,
+        fetch_engine=None,
+        offline=False,
+        matrix_store=None,
+        upstream=None,
+        memo_columns=20000,
+    ):
+        """
+        args:
+            geoDB (GeoDB): Geography names and fips codes
+            vars_config (List[Dict]): Variable config, as returned by load_config
+            api_key (str): data.census.gov api key
+            cache (census_cache.CensusCache): Optional census api response cache
+            fetch_engine (fetch_engine.FetchEngine): Runs census api downloads. 
+                A new one is created if not given.
+            offline (bool): Answer from the cache only, never calling the census 
+                api. Populate the cache with warm_cache.py first.
+            matrix_store (matrix_store.CountyMatrixStore): Optional memory mapped 
+                raw data, used instead of the cache for queries it covers
+            upstream (upstream.UpstreamGuard): Rate limits, times out and retries 
+                census api calls. Defaults to timeouts and retries only.
+            memo_columns (int): Number of (state, variable) columns of raw data 
+                kept in memory, so later queries only fetch what they add
+        """
         self.geoDB = geoDB
-        self._vars_config = vars_config
         self.api_key = api_key
+        self.cache = cache
+        self.offline = offline
+        self.matrix_store = matrix_store
+        self.fetch_engine = fetch_engine if fetch_engine is not None else FetchEngine()
+        self.upstream = upstream if upstream is not None else UpstreamGuard()
+        self._memo = _RawDataMemo(
+            max_columns=memo_columns, ttl=cache.ttl if cache is not None else None
+        )
+
+        self._vars_config = None
+        self.update_config(vars_config)
+
+    def update_config(self, vars_config):
+        """
+        Sets the variable config. Structures derived from the config (variable
+        ids, categories, selector choices) are built here once, and only rebuilt
+        when a different config object is passed in.
+
+        args:
+            vars_config (List[Dict]): Variable config, as returned by load_config.
+                Its compiled definitions are reused if it has them.
+        """
+
+        if vars_config is self._vars_config:
+            return
+
+        self._vars_config = vars_config
+        # identifies this config, e.g. for http cache validators
+        self.config_version = hashlib.sha256(
+            json.dumps(vars_config, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:16]
+        self._vars_with_ids = tuple(
+            dict(var, id=i) for i, var in enumerate(vars_config)
+        )
+        self._available_categories = tuple(
+            sorted(set(var["category"] for var in self._vars_with_ids))
+        )
+        # built on first use (see _build_formatted_dataframe), so startup 
+        # doesn't need pandas
+        self._vars_df = None
+        plan = getattr(vars_config, "plan", None)
+        self._definitions = (
+            plan if plan is not None else compile_definitions(vars_config)
+        )
+        self._available_vars = None
+
+    def clear_memo(self):
+        """
+        Drops raw data held in memory from earlier queries.
+        """
+        self._memo.clear()
 
     @property
     def vars_config(self):
-        return [dict(var, id=i) for i, var in enumerate(self._vars_config)]
+        return self._vars_with_ids
     
     @property
     def available_categories(self):
-        return sorted(list(set([var["category"] for var in self.vars_config])))
+        return self._available_categories
 
     def _build_geos(self, geo_names, geo_type="county"):
         '''
-        Builds list of state, county fips code pairs to pass to census api
+        Builds list of state, county fips code pairs to pass to census api. 
+        State, region and nation geographies are built from their counties.
         args:
-            geo_names (List[Tuple[str, str]]): List of state, county name pairs
-            geo_type: Geography type
+            geo_names (List): List of state, county name pairs for geo_type 
+                "county", otherwise see _rollup_members
+            geo_type: Geography type: "county", or one of ROLLUP_TYPES
         returns:
             List[List[str, str]]
         '''
         
         if geo_type != "county":
-            raise NotImplementedError
+            geo_names, _, _ = self._rollup_members(geo_names, geo_type)
 
         # build list of state-county fips code pairs
-        geo_fips = []
-        for state, county in geo_names:
-            geo_fips.append(
-                [
-                    self.geoDB.get_state_fips(state),
-                    self.geoDB.get_county_fips(state, county),
-                ]
-            )
-        return geo_fips
+        return [list(fips) for fips in self.geoDB.resolve_many(geo_names)]
+
+    def _rollup_members(self, geo_names, geo_type):
+        '''
+        Lists the counties making up state, region or nation geographies.
+
+        args:
+            geo_names (List): state names for geo_type "state", (region name, 
+                List of state, county name pairs) pairs for "region", ignored 
+                for "nation"
+            geo_type (str): One of ROLLUP_TYPES
+        returns:
+            (List[List[str, str]], List[str], List[int]):
+            - state, county name pairs of the members, grouped by geography
+            - name of each geography
+            - position of each geography's first member
+        '''
+
+        state_counties = self.geoDB.get_state_counties
+
+        if geo_type == "state":
+            groups = [
+                (state, [[state, county] for county in state_counties(state)])
+                for state in geo_names
+            ]
+        elif geo_type == "region":
+            groups = [
+                (name, [[state, county] for state, county in counties])
+                for name, counties in geo_names
+            ]
+        elif geo_type == "nation":
+            groups = [
+                (
+                    NATION_NAME,
+                    [
+                        [state, county]
+                        for state in self.geoDB.get_states()
+                        for county in state_counties(state)
+                    ],
+                )
+            ]
+        else:
+            raise NotImplementedError(geo_type)
+
+        empty = [name for name, members in groups if not members]
+        if empty:
+            raise UnknownGeography("No counties in {}".format(", ".join(empty)))
+
+        county_names, names, starts = [], [], []
+        for name, members in groups:
+            names.append(name)
+            starts.append(len(county_names))
+            county_names += members
+        return county_names, names, starts
 
     @staticmethod
-    def _build_state_dataframe(state_fips, var_ids, src, year, tabletype, api_key):
+    @timed("rollup")
+    def _sum_members(raw_data, starts, names):
+        '''
+        Rolls raw county data up into geographies, by summing the counts of 
+        each geography's members. A sum is missing if any member's value is
+        missing or a negative annotation code.
+
+        args:
+            raw_data (Pandas.DataFrame): raw data of member counties, grouped by 
+                geography
+            starts (List[int]): position of each geography's first member
+            names (List[str]): name of each geography
+        returns:
+            Pandas.DataFrame: raw data indexed by geography name
+        '''
+
+        values = raw_data.to_numpy(dtype=np.float64)
+        # negative values are census annotations (e.g. -666666666 for an
+        # estimate that couldn't be computed), not counts
+        values = np.where(values < 0, np.nan, values)
+        values = np.add.reduceat(values, starts, axis=0)
+        sums = pd.DataFrame(
+            values, index=pd.Index(names, name="county"), columns=raw_data.columns
+        )
+        integer_vars = raw_data.columns[
+            [pd.api.types.is_integer_dtype(dtype) for dtype in raw_data.dtypes]
+        ]
+        for var in integer_vars:
+            if not sums[var].isna().any():
+                sums[var] = sums[var].astype(np.int64)
+        return sums
+
+    @staticmethod
+    @timed("census_download")
+    def _build_state_dataframe(
+        state_fips, var_ids, src, year, tabletype, api_key, timeout=None
+    ):
         """
-        Queries census API for county-level data
+        Queries census API for county-level data in a state, or in all states if 
+        state_fips is ALL_STATES
             geos (list[list[str, str]]): List of state, county name pairs
             census_vars (list[dict]): List of variable specification dicts
             key (str): data.census.gov api key
+            timeout (float): seconds to wait on the census api, see 
+                census_api.download
         """
 
         # build list of var ids, and dict of id-name mappings
 
-        state_data = censusdata.download(
+        state_data = census_api.download(
             src,
             year,
             censusdata.censusgeo([("state", state_fips), ("county", "*")]),
             var_ids,
             key=api_key,
             tabletype=tabletype,
+            timeout=timeout,
         )
 
         # we'll need this
@@ -203,20 +687,171 @@ class CensusViewer:
         return state_fips, state_data
 
     @staticmethod
-    def _apply_transforms(df, definitions):
+    def _job_key(job):
+        """
+        Normalized identity of a _build_state_dataframe job, used to coalesce
+        identical downloads requested concurrently by different queries.
+        """
+        state_fips, var_ids, src, year, tabletype, _ = job
+        return (src, year, state_fips, tabletype, tuple(sorted(var_ids)))
+
+    def _download_and_cache(self, job):
+        """
+        Runs a _build_state_dataframe job and caches its result. Runs once per
+        job, even when several queries wait on it.
+
+        returns:
+            Dict[str: DataFrame]: downloaded data for each state fips code
+        """
+
+        job_state_fips, job_data = self.upstream.call(self._build_state_dataframe, *job)
+
+        if job_state_fips == ALL_STATES:
+            state_dfs = self._split_states(job_data)
+        else:
+            state_dfs = {job_state_fips: job_data}
+
+        # national results are cached for every state, not just the selected ones
+        src, year, tabletype = job[2], job[3], job[4]
+        for fips, state_data in state_dfs.items():
+            self._memo.put((src, year, fips, tabletype), fips, state_data)
+            if self.cache is not None:
+                self.cache.put(src, year, fips, tabletype, state_data)
+
+        return state_dfs
+
+    def _stale_fallback(self, job, targets, error):
+        """
+        Reads data for a failed download from the cache, including entries past 
+        the cache's ttl, so a failing census api degrades to the last cached 
+        data instead of an error.
+
+        args:
+            job (List): failed _build_state_dataframe arguments
+            targets (Dict[str: List[str]]): variable ids needed per state fips
+            error (UpstreamError): why the download failed, raised again if the 
+                cache can't cover it
+        returns:
+            Dict[str: DataFrame]: cached data for each state fips code
+        """
+
+        src, year, tabletype = job[2], job[3], job[4]
+
+        state_dfs = {}
+        for fips, var_ids in targets.items():
+            cached_df, missing = (
+                self.cache.get(src, year, fips, tabletype, var_ids, allow_stale=True)
+                if self.cache is not None
+                else (None, var_ids)
+            )
+            if missing:
+                raise error
+            state_dfs[fips] = cached_df
+
+        logger.warning("census api unavailable (%s), serving stale cached data", error)
+        return state_dfs
+
+    @timed("plan")
+    def _plan_census_jobs(self, state_fips, tabletype_jobs, src, year):
+        """
+        Plans the census api queries needed for a set of states and tabletypes.
+
+        Vars are looked up in memory first, then in the census cache. For each 
+        tabletype, makes one query per state that still has missing vars, or a 
+        single national query if at least NATIONAL_FETCH_THRESHOLD states do.
+
+        args:
+            state_fips (List[str]): fips codes of selected states
+            tabletype_jobs (List[List[List[str], str]]): vars & tabletype pairs
+            src (str): Census api source parameter
+            year (int): Census api year parameter
+        returns:
+            (List[List], List[Dict[str: List[str]]], List[Tuple[str, DataFrame]]):
+            - arguments for _build_state_dataframe, one list per query
+            - for each query, the vars needed from it for each selected state
+            - cached data, as (state fips, dataframe) pairs. Dataframes are 
+              indexed by censusgeo or by county code
+        """
+
+        census_jobs = []
+        job_targets = []
+        cached_dfs = []
+        plan = []
+
+        for tabletype_vars, tabletype in tabletype_jobs:
+            tabletype_vars = list(dict.fromkeys(tabletype_vars))
+
+            missing = {}
+            for fips in state_fips:
+                memo_key = (src, year, fips, tabletype)
+                held_df, state_vars = self._memo.get(memo_key, tabletype_vars)
+                if held_df is not None:
+                    cached_dfs.append((fips, held_df))
+                if self.cache is not None and state_vars:
+                    cached_df, state_vars = self.cache.get(
+                        src, year, fips, tabletype, state_vars
+                    )
+                    if cached_df is not None:
+                        cached_dfs.append((fips, cached_df))
+                        self._memo.put(memo_key, fips, cached_df)
+                if state_vars:
+                    missing[fips] = state_vars
+
+            if len(missing) >= NATIONAL_FETCH_THRESHOLD:
+                national_vars = list(
+                    dict.fromkeys(var for vars_ in missing.values() for var in vars_)
+                )
+                census_jobs.append(
+                    [ALL_STATES, national_vars, src, year, tabletype, self.api_key]
+                )
+                job_targets.append(missing)
+                plan.append(f"{tabletype}: 1 national query")
+            else:
+                for fips, state_vars in missing.items():
+                    census_jobs.append(
+                        [fips, state_vars, src, year, tabletype, self.api_key]
+                    )
+                    job_targets.append({fips: state_vars})
+                plan.append(f"{tabletype}: {len(missing)} state queries")
+
+        if self.offline and census_jobs:
+            raise OfflineCacheMiss(
+                "Data missing from census cache ({}). Run warm_cache.py to "
+                "populate it.".format("; ".join(plan))
+            )
+
+        logger.debug(
+            "census fetch plan (%s %s, %d states): %s",
+            src,
+            year,
+            len(state_fips),
+            "; ".join(plan) or "all cached",
+        )
+
+        return census_jobs, job_targets, cached_dfs
+
+    @staticmethod
+    def _split_states(df):
+        """
+        Splits a national query result into one dataframe per state.
+
+        returns:
+            Dict[str: Pandas.DataFrame]: state fips code -> state data
+        """
+
+        state_codes = [geo.params()[0][1] for geo in df.index]
+        return {fips: state_df for fips, state_df in df.groupby(state_codes)}
+
+    @timed("transforms")
+    def _apply_transforms(self, df, selected_vars):
         """
         df (Pandas.DataFrame): Dataframe containing raw data queried from Census
             API
-        definitions (List[Tuple[str, str]]): List of (name, definition) pairs.
-            Column definitions should be strings containing valid Python expressions. 
-            Expressions can reference other columns in df by name. Example:
+        selected_vars (List[Dict]): List of variables whose definitions should be
+            applied. Definitions are strings containing arithmetic expressions that 
+            reference census variable ids by name. Example:
 
-            [
-                (
-                    "Column Name",
-                    "(B02001_001E - B02001_002E) / B02001_001E"
-                )
-            ]
+            "(B02001_001E - B02001_002E) / B02001_001E"
 
             This expression references columns containing data for census variables
             B02001_001E (population, all races) and B02001_002E (population, white).
@@ -224,15 +859,17 @@ class CensusViewer:
             It calculates the proportion of a geography's population identifying as 
             a race other than White.
 
-            See https://plydata.readthedocs.io/en/latest/generated/plydata.one_table_verbs.define.html
-            for more on how these expressions are evaluated 
+            Definitions are compiled once per config (see 
+            definitions.compile_definitions), and evaluated together as numpy 
+            operations over the raw data.
 
         returns (Pandas DataFrame): Dataframe containing transformed columns
         """
 
-        all_vars = df.columns.values
-        df = plydata.define(df, *definitions).drop(all_vars, axis=1)
-        return df
+        names, values = self._definitions.evaluate(
+            df, [var["id"] for var in selected_vars]
+        )
+        return pd.DataFrame(dict(zip(names, values.T)), index=df.index)
 
     def _build_formatted_dataframe(self, df, selected_vars):
 
@@ -251,11 +888,13 @@ class CensusViewer:
 
         """
 
-        column_definitions = [(var["name"], var["definition"]) for var in selected_vars]
-
-        transformed_county_data = self._apply_transforms(df, column_definitions)
+        transformed_county_data = self._apply_transforms(df, selected_vars)
 
-        vars_df = pd.DataFrame.from_dict(self.vars_config)[["category", "name"]]
+        if self._vars_df is None:
+            self._vars_df = pd.DataFrame(list(self._vars_with_ids))[
+                ["category", "name"]
+            ]
+        vars_df = self._vars_df
         formatted_data = (
             transformed_county_data.transpose()
             .reset_index()
@@ -264,46 +903,73 @@ class CensusViewer:
         )
         return formatted_data
 
-    def _build_dataframe(
-        self, county_names, selected_vars, descriptions=False, src="acs5", year=2018
-    ):
-        """
-        Creates dataframe view of variables in requested counties. Main helper 
-        view function, ie does most of the work of munging frontend queries and 
-        coordinating lower-level helper functions.
+    def _matrix_store_covers(self, var_ids, src, year):
+        store = self.matrix_store
+        return (
+            store is not None
+            and store.src == src
+            and store.year == year
+            and store.has_vars(var_ids)
+        )
 
-        Does some optimization to run census api queries in parallel. Consider tweaking 
-        N_PROCESSES parameter to affect performance.
+    @timed("matrix_store")
+    def _slice_matrix_rollups(self, geo_names, geo_type, names, var_ids):
+        """
+        Reads precomputed state or nation rollups from the matrix store.
 
-        args:
-            county_names (List[str]): List of state, county name pairs
-            selected_vars (List[Dict]): List of variable dicts
-            descriptions (boolean): Boolean controlling whether to include variable
-                descriptions in df output (not implemented)
-            src (str): Census api source parameter
-            year (int): Census api year parameter        
+        returns:
+            Pandas.DataFrame: raw data indexed by geography name
         """
 
-        # generate list of selected census api variable ids
+        if geo_type == "nation":
+            codes = [NATION_CODE]
+        else:
+            codes = [
+                state_code(self.geoDB.get_state_fips(state)) for state in geo_names
+            ]
+        raw_data = self.matrix_store.slice_rollups(codes, var_ids)
+        raw_data.index = pd.Index(names, name="county")
+        return raw_data
 
-        all_vars = []
-        for var in selected_vars:
-            all_vars += var["vars"]
+    @timed("matrix_store")
+    def _slice_matrix_store(self, county_names, var_ids):
+        """
+        Reads raw data for selected counties from the matrix store.
 
-        tabletypes = [
-            ("B", r"detail"),
-            ("S", r"subject"),
-            ("DP", r"profile"),
-            ("CP", r"cprofile"),
+        returns:
+            Pandas.DataFrame: raw data indexed by "county, state" names
+        """
+
+        county_codes = [
+            county_code(state_fips, county_fips)
+            for state_fips, county_fips in self.geoDB.resolve_many(county_names)
         ]
+        raw_data = self.matrix_store.slice(county_codes, var_ids)
+        raw_data.index = [f"{county}, {state}" for state, county in county_names]
+        raw_data.index.name = "county"
+        return raw_data
 
-        all_vars = []
-        for var in selected_vars:
-            all_vars += var["vars"]
+    def _fetch_raw_data(self, county_names, all_vars, query_vintages):
+        """
+        Gets raw data for selected counties from the census cache, downloading 
+        what's missing from the census api. Downloads for every vintage are 
+        planned together and run in one parallel wave, so querying several 
+        years takes about as long as querying one.
+
+        args:
+            county_names (List[str]): List of state, county name pairs
+            all_vars (List[str]): census api variable ids
+            query_vintages (List[Tuple[str, int]]): Census api (src, year) pairs
+        returns:
+            Dict[Tuple[str, int]: Pandas.DataFrame]: raw data for each vintage, 
+                indexed by "county, state" names
+        """
 
         # Within one census api query, all vars must be from same table type &
-        # all counties must be from same state. So we make one call to 
-        # censusdata.download for each state x tabletype.  
+        # all counties must be from same state (or from all states), and from 
+        # the same src & year. So we make one call to censusdata.download for 
+        # each vintage x state x tabletype, or one national call per vintage x 
+        # tabletype for selections spanning many states.
 
         # So:
         # 1. build list of states
@@ -314,68 +980,220 @@ class CensusViewer:
         # 2. build list of tabletypes (& corresponding vars)
 
         tabletype_jobs = []
-        for table_prefix, tabletype in tabletypes:
+        for table_prefix, tabletype in TABLETYPES:
 
             tabletype_vars = [var for var in all_vars if var.startswith(table_prefix)]
 
             if tabletype_vars:
                 tabletype_jobs.append([tabletype_vars, tabletype])
 
-        # 3. cross product: states x tabletypes
+        # 3. preallocate the result of each vintage: one row per selected county, 
+        # in selection order, one column per variable. Rows are located by 
+        # integer county code
 
-        census_jobs = []
+        var_ids = list(dict.fromkeys(all_vars))
+        county_codes = [
+            county_code(state_fips_, county_fips)
+            for state_fips_, county_fips in self.geoDB.resolve_many(county_names)
+        ]
+        assemblies = {
+            vintage: _RawDataAssembly(county_codes, var_ids)
+            for vintage in query_vintages
+        }
 
-        for state_fips, (tabletype_vars, tabletype) in product(
-            state_fips, tabletype_jobs
-        ):
-            census_jobs.append(
-                [state_fips, tabletype_vars, src, year, tabletype, self.api_key]
+        # 4. plan downloads: vintages x states x tabletypes, skipping cached vars. 
+        # Switches to one national query per tabletype when many states are 
+        # needed
+
+        census_jobs = []
+        job_targets = []
+        for src, year in query_vintages:
+            vintage_jobs, vintage_targets, cached_dfs = self._plan_census_jobs(
+                state_fips, tabletype_jobs, src, year
             )
+            census_jobs += vintage_jobs
+            job_targets += vintage_targets
+
+            for fips, cached_df in cached_dfs:
+                assemblies[(src, year)].fill(fips, cached_df)
+
+        # 5. run all of the downloads (in parallel), filling in each result as 
+        # it arrives
+
+        futures = {
+            self.fetch_engine.submit_shared(
+                self._job_key(job), self._download_and_cache, job
+            ): (job, targets)
+            for job, targets in zip(census_jobs, job_targets)
+        }
+
+        for future in as_completed(futures):
+            job, targets = futures[future]
+            try:
+                state_dfs = future.result()
+            except UpstreamError as e:
+                state_dfs = self._stale_fallback(job, targets, e)
+
+            assembly = assemblies[(job[2], job[3])]
+            for fips, state_data in state_dfs.items():
+                if fips in targets:
+                    assembly.fill(fips, state_data[targets[fips]])
+
+        # 6. label rows with county names
+
+        labels = [f"{county}, {state}" for state, county in county_names]
+        return {
+            vintage: assembly.to_dataframe(labels)
+            for vintage, assembly in assemblies.items()
+        }
 
-        # 4. run all of the downloads (in parallel)
+    @staticmethod
+    @timed("align_vintages")
+    def _align_vintages(frames, names, query_vintages):
+        """
+        Aligns raw data for several vintages into a single frame, with one row 
+        per geography and vintage, labelled by vintage_labels. Geographies stay 
+        in selection order, each followed by one row per vintage.
 
-        pool = Pool(N_PROCESSES)
+        args:
+            frames (List[Pandas.DataFrame]): raw data for each vintage, one row 
+                per selected geography, in selection order
+            names (List[str]): name of each selected geography
+            query_vintages (List[Tuple[str, int]]): (src, year) of each frame
+        returns:
+            Pandas.DataFrame
+        """
 
-        raw_dfs = pool.starmap(self._build_state_dataframe, census_jobs)
+        n_geos, n_vintages = len(names), len(query_vintages)
 
-        # 5. merge all
+        # concatenated rows are grouped by vintage; regroup them by geography
+        aligned = pd.concat(frames, ignore_index=True)
+        order = np.arange(n_geos * n_vintages).reshape(n_vintages, n_geos)
+        aligned = aligned.take(order.T.ravel())
 
-        merged_state_dfs = []
-        for state in set(state for state, _ in raw_dfs):
-            raw_state_dfs = [
-                state_data for state_, state_data in raw_dfs if state_ == state
-            ]
-            merged_state_df = reduce(
-                lambda x, y: pd.merge(
-                    x, y, left_index=True, right_index=True, how="outer"
-                ),
-                raw_state_dfs,
-            )
+        aligned.index = pd.Index(
+            vintage_labels(names, query_vintages), name="county"
+        )
+        return aligned
 
-            merged_state_dfs.append(merged_state_df)
+    def _build_dataframe(
+        self,
+        geo_names,
+        selected_vars,
+        descriptions=False,
+        src="acs5",
+        year=2018,
+        geo_type="county",
+    ):
+        """
+        Creates dataframe view of variables in requested geographies. Main helper 
+        view function, ie does most of the work of munging frontend queries and 
+        coordinating lower-level helper functions.
 
-        merged_dfs = pd.concat(
-            merged_state_dfs,
-        )
+        Runs census api queries in parallel on the viewer's FetchEngine. Consider 
+        tweaking its max_workers/per_host_limit parameters to affect performance. 
+        If a CensusCache was passed to the constructor, only variables missing from 
+        the cache are downloaded. Queries covered by the viewer's matrix store are
+        read from it directly.
 
-        # 6. filter on counties
+        Queries for more than one vintage (see vintages) get one column per 
+        geography and vintage, labelled by vintage_labels.
 
-        raw_data = (
-            merged_dfs.assign(county=merged_dfs.index.map(lambda x: x.name))
-            .set_index("county")
-            .filter([f"{county}, {state}" for state, county in county_names], axis=0)
-        )
+        State, region and nation geographies are rolled up from the raw data of 
+        their counties (see _sum_members), before definitions are applied.
+
+        args:
+            geo_names (List): List of state, county name pairs for geo_type 
+                "county", otherwise see _rollup_members
+            selected_vars (List[Dict]): List of variable dicts
+            descriptions (boolean): Boolean controlling whether to include variable
+                descriptions in df output (not implemented)
+            src (str or List[str]): Census api source parameter(s)
+            year (int or List[int]): Census api year parameter(s)
+            geo_type (str): "county", or one of ROLLUP_TYPES
+        """
+
+        # generate list of selected census api variable ids
+
+        all_vars = []
+        for var in selected_vars:
+            all_vars += var["vars"]
+
+        if geo_type == "county":
+            county_names, labels, starts = geo_names, county_labels(geo_names), None
+        else:
+            county_names, labels, starts = self._rollup_members(geo_names, geo_type)
+
+        # raw data comes from the memory mapped matrix store for vintages it 
+        # covers, and from the census cache/api otherwise. States and the nation 
+        # are read from the store's precomputed rollups
+
+        query_vintages = vintages(src, year)
+        precomputed = geo_type in ("state", "nation")
+        frames = {}
+        county_frames = {}
+        fetched = []
+        for vintage in query_vintages:
+            if not self._matrix_store_covers(all_vars, *vintage):
+                fetched.append(vintage)
+            elif precomputed and self.matrix_store.rollups is not None:
+                frames[vintage] = self._slice_matrix_rollups(
+                    geo_names, geo_type, labels, all_vars
+                )
+            else:
+                county_frames[vintage] = self._slice_matrix_store(
+                    county_names, all_vars
+                )
+        if fetched:
+            county_frames.update(
+                self._fetch_raw_data(county_names, all_vars, fetched)
+            )
+
+        for vintage, raw in county_frames.items():
+            frames[vintage] = (
+                raw if starts is None else self._sum_members(raw, starts, labels)
+            )
+
+        if len(query_vintages) == 1:
+            raw_data = frames[query_vintages[0]]
+        else:
+            # one column per geography and vintage in the formatted output
+            raw_data = self._align_vintages(
+                [frames[vintage] for vintage in query_vintages], labels, query_vintages
+            )
 
         # 7. format (apply column definitions)
 
         formatted_county_data = self._build_formatted_dataframe(raw_data, selected_vars)
 
+        if starts is not None:
+            # medians, averages and rates can't be summed across counties
+            unsummable = [
+                (var["name"], var["category"])
+                for var in selected_vars
+                if var.get("rollup", "sum") == "none"
+            ]
+            masked = pd.MultiIndex.from_frame(
+                formatted_county_data[["name", "category"]]
+            ).isin(unsummable)
+            columns = [
+                col for col in formatted_county_data.columns
+                if col not in ("name", "category")
+            ]
+            if masked.any():
+                formatted_county_data[columns] = formatted_county_data[
+                    columns
+                ].astype(np.float64)
+                formatted_county_data.loc[masked, columns] = np.nan
+
         if descriptions:
             pass
 
         return formatted_county_data
 
-    def _build_dict_view(self, df, categories):
+    @staticmethod
+    @timed("dict_view")
+    def _build_dict_view(df, categories):
         '''
         Converts df view to dict.
         
@@ -394,6 +1212,139 @@ class CensusViewer:
             formatted_data_dict[category] = rows
         return formatted_data_dict
 
+    @staticmethod
+    @timed("table_page")
+    def _build_table_page(df, category, col_start, col_count):
+        '''
+        Slices one category and a range of county columns out of df, columnar.
+
+        args:
+            df (Pandas.dataframe): dataframe output of queried data
+            category (str): category name
+            col_start (int): position of the first county column
+            col_count (int): maximum number of county columns
+        returns:
+            Dict: {"category": str, "rows": [variable names], "col_start": int, 
+                "total_columns": int, "columns": [county names], 
+                "values": [[values of each row, for one column], ...]}
+                Missing values are None.
+        '''
+
+        counties = [col for col in df.columns if col not in ("name", "category")]
+        columns = counties[col_start : col_start + col_count]
+        rows = df.loc[df.category == category]
+
+        values = rows[columns].astype(object)
+        values = values.where(values.notna(), None)
+
+        return {
+            "category": category,
+            "rows": rows["name"].tolist(),
+            "col_start": col_start,
+            "total_columns": len(counties),
+            "columns": columns,
+            "values": values.to_numpy().T.tolist(),
+        }
+
+    @staticmethod
+    @timed("chart_data")
+    def _build_chart_data(df):
+        '''
+        Builds chartkick pie chart data for each county and category.
+
+        args:
+            df (Pandas.dataframe): dataframe output of queried data
+        returns:
+            Dict[str: Dict[str: List[Dict[str: float]]]]: county name -> category 
+                -> list containing one {variable name: value} dict
+        '''
+
+        counties = [col for col in df.columns if col not in ("name", "category")]
+        all_charts = {county: {} for county in counties}
+
+        # one block of values per category: rows are variables, columns counties
+        for category, group in df.groupby("category", sort=True):
+            names = group["name"].astype(str).tolist()
+            values = group[counties].to_numpy()
+            if values.dtype.kind == "f":
+                # NaN isn't valid json
+                values = np.where(np.isnan(values), None, values)
+
+            for county, county_values in zip(counties, values.T.tolist()):
+                all_charts[county][str(category)] = [dict(zip(names, county_values))]
+
+        return all_charts
+
+    def query(self, county_names, selected_var_ids, src="acs5", year=2018):
+        """
+        Builds a QueryResult for the selected counties and variables. Census data
+        is queried once, when one of the result's views is first accessed.
+
+        Args:
+            county_names (list[list(str, str)]): List of state, county name pairs
+            selected_var_ids (list[str]): Ids of selected variables
+            src (str or list[str]): data.census.gov API source(s) to be used
+            year (int or list[int]): Year(s) to query census data for. Queries 
+                for several years (or sources) get one column per county and 
+                year, see vintage_labels
+
+        returns QueryResult
+        """
+
+        selected_vars = [
+            var for var in self.vars_config if str(var["id"]) in selected_var_ids
+        ]
+
+        return QueryResult(
+            county_names,
+            selected_vars,
+            lambda: self._build_dataframe(
+                county_names, selected_vars, src=src, year=year
+            ),
+            vintages(src, year),
+        )
+
+    def query_rollup(
+        self, geo_names, selected_var_ids, geo_type="state", src="acs5", year=2018
+    ):
+        """
+        Builds a QueryResult for states, custom regions (groups of counties) or 
+        the whole nation. Each geography's raw census counts are the sums of 
+        its counties', so no other census api queries are needed, and 
+        definitions (e.g. ratios) are applied to the sums. Variables that can't 
+        be summed across counties (rollup "none" in vars.json, e.g. medians) 
+        are left empty.
+
+        States and the nation are read from the matrix store's precomputed 
+        rollups when it covers the query.
+
+        Args:
+            geo_names (list): State names for geo_type "state", (region name, 
+                list of state, county name pairs) pairs for "region". Ignored 
+                for "nation".
+            selected_var_ids (list[str]): Ids of selected variables
+            geo_type (str): "state", "region" or "nation"
+            src (str or list[str]): data.census.gov API source(s) to be used
+            year (int or list[int]): Year(s) to query census data for
+
+        returns QueryResult
+        """
+
+        selected_vars = [
+            var for var in self.vars_config if str(var["id"]) in selected_var_ids
+        ]
+        county_names, names, _ = self._rollup_members(geo_names, geo_type)
+
+        return QueryResult(
+            county_names,
+            selected_vars,
+            lambda: self._build_dataframe(
+                geo_names, selected_vars, src=src, year=year, geo_type=geo_type
+            ),
+            vintages(src, year),
+            geo_names=names,
+        )
+
     def view_dict(self, county_names, selected_var_ids, src="acs5", year=2018):
 
         """
@@ -402,8 +1353,8 @@ class CensusViewer:
 
         Args:
             county_names (list[list(str, str)]): List of county, state name pairs
-            src (str): data.census.gov API source to be used. (currently unused)
-            year (int): Year to query census data. (currently unused)
+            src (str or list[str]): data.census.gov API source(s) to be used
+            year (int or list[int]): Year(s) to query census data for
 
         returns (dict, list[str]):
         -   dict containing census output formatted to be consumed by renderer.
@@ -417,51 +1368,35 @@ class CensusViewer:
         -   List of column names
         """
 
-        selected_vars = [
-            var for var in self.vars_config if str(var["id"]) in selected_var_ids
-        ]
-
-        county_data = self._build_dataframe(county_names, selected_vars)
-
-        county_data_dict = self._build_dict_view(
-            county_data, sorted(list(set([var["category"] for var in selected_vars])))
-        )
-
-        formatted_county_names = [
-            "{county}, {state}".format(state=state, county=county)
-            for state, county in county_names
-        ]
+        result = self.query(county_names, selected_var_ids, src=src, year=year)
 
-        colnames = ["Column Name"] + formatted_county_names
+        return result.dict_view, result.colnames
 
-        return county_data_dict, colnames
-
-    def view_df(self, county_names, selected_var_ids):
+    def view_df(self, county_names, selected_var_ids, src="acs5", year=2018):
 
         """
         Builds view of census data stored in a Pandas dataframe
 
         Args:
             county_names (list[list(str, str)]): List of county, state name pairs
-            src (str): data.census.gov API source to be used. (currently unused)
-            year (int): Year to query census data. (currently unused)
+            src (str or list[str]): data.census.gov API source(s) to be used
+            year (int or list[int]): Year(s) to query census data for
 
         returns Pandas.DataFrame
         """
 
-        selected_vars = [
-            var for var in self.vars_config if str(var["id"]) in selected_var_ids
-        ]
-
-        return self._build_dataframe(county_names, selected_vars)
+        return self.query(county_names, selected_var_ids, src=src, year=year).df
 
     @property
     def available_vars(self):
         """
         Returns available variables. Partially constructs html for each option's
-        tooltip.
+        tooltip. Built once per config (see update_config).
         """
 
+        if self._available_vars is not None:
+            return self._available_vars
+
         var_list = []
 
         #TODO: Refactor tooltip HTML insertion to view level. Current approach is... kinda hacky
@@ -484,4 +1419,98 @@ class CensusViewer:
                 if var["category"] == category
             ]
             var_list.append(tuple([category, tuple(cat_list)]))
-        return var_list
+
+        self._available_vars = tuple(var_list)
+        return self._available_vars
+
+
+class QueryResult:
+    """
+    Result of one census query. The dataframe is built once, the first time
+    it's needed, and the other views (dict, csv, chart data) are derived from
+    that same dataframe when first accessed.
+
+    Built by CensusViewer.query and CensusViewer.query_rollup.
+
+    args:
+        county_names (List[List[str, str]]): List of state, county name pairs
+        selected_vars (List[Dict]): List of selected variable dicts
+        build_df (Callable[[], Pandas.DataFrame]): Builds the dataframe view
+        vintages (List[Tuple[str, int]]): Census api (src, year) pairs queried
+        geo_names (List[str]): Names of the result's geographies, if they 
+            aren't the counties themselves (rollups)
+    """
+
+    def __init__(
+        self,
+        county_names,
+        selected_vars,
+        build_df,
+        vintages=(("acs5", 2018),),
+        geo_names=None,
+    ):
+        self.county_names = county_names
+        self.selected_vars = selected_vars
+        self.vintages = list(vintages)
+        self.geo_names = (
+            geo_names if geo_names is not None else county_labels(county_names)
+        )
+        self._build_df = build_df
+        self._df = None
+        self._dict_view = None
+        self._chart_data = None
+
+    def __getstate__(self):
+        # results are pickled by SQLiteResultStore; keep the data, not the
+        # reference back to the viewer
+        state = dict(self.__dict__, _df=self.df)
+        state["_build_df"] = None
+        return state
+
+    def __setstate__(self, state):
+        # results stored before vintages were recorded are acs5 2018
+        state.setdefault("vintages", [("acs5", 2018)])
+        state.setdefault("geo_names", county_labels(state["county_names"]))
+        self.__dict__.update(state)
+
+    @property
+    def categories(self):
+        return sorted(set(var["category"] for var in self.selected_vars))
+
+    @property
+    def colnames(self):
+        return ["Column Name"] + vintage_labels(self.geo_names, self.vintages)
+
+    @property
+    def df(self):
+        if self._df is None:
+            self._df = self._build_df()
+        return self._df
+
+    @property
+    def dict_view(self):
+        """
+        Dict view, in the format described in CensusViewer.view_dict
+        """
+        if self._dict_view is None:
+            self._dict_view = CensusViewer._build_dict_view(self.df, self.categories)
+        return self._dict_view
+
+    @property
+    def chart_data(self):
+        """
+        Chart data, in the format described in CensusViewer._build_chart_data
+        """
+        if self._chart_data is None:
+            self._chart_data = CensusViewer._build_chart_data(self.df)
+        return self._chart_data
+
+    def table_page(self, category, col_start=0, col_count=50):
+        """
+        Page of the results table, in the format described in 
+        CensusViewer._build_table_page
+        """
+        return CensusViewer._build_table_page(self.df, category, col_start, col_count)
+
+    def to_csv(self):
+        return self.df.to_csv(index=False)
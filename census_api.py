@@ -0,0 +1,199 @@
+"""
+    Census api client for data downloads. Works like censusdata.download and
+    returns the same dataframes, but passes a timeout to each http request and
+    raises CensusApiError with the response's status code, so failures worth
+    retrying (see transient_error) can be told apart from bad requests.
+"""
+import threading
+
+from lazy import LazyModule
+
+# only needed to answer queries, so not imported at startup
+pd = LazyModule("pandas")
+censusdata = LazyModule("censusdata")
+requests = LazyModule("requests")
+
+API_URL = "https://api.census.gov/data/"
+TABLETYPES = ("detail", "subject", "profile", "cprofile")
+
+# the census api returns at most 50 variables per query, including NAME
+CHUNK_SIZE = 49
+
+# connections to the census api kept open for reuse. Should match the most
+# concurrent calls to it, see configure
+_pool_size = 4
+_session = None
+_session_lock = threading.Lock()
+
+
+class CensusApiError(Exception):
+    """
+    Raised when the census api answers with an error or an unreadable response.
+
+    args:
+        message (str): error message
+        status (int): http status code of the response
+    """
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def transient_error(error):
+    """
+    Whether a failed census api call is worth retrying: network errors,
+    timeouts, rate limiting (429) and server errors (5xx). Other errors, e.g. a
+    400 for an unknown variable or year, fail the same way every time.
+    """
+
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return (
+        isinstance(error, CensusApiError)
+        and error.status is not None
+        and (error.status == 429 or error.status >= 500)
+    )
+
+
+def configure(pool_size):
+    """
+    Sets how many connections to the census api are kept open, e.g. to the
+    fetch engine's per host limit. Takes effect for sessions created after it.
+    """
+
+    global _pool_size, _session
+    with _session_lock:
+        _pool_size = pool_size
+        _session = None
+
+
+def session():
+    """
+    returns:
+        requests.Session: session shared by all downloads, so connections to
+            the census api are kept alive and reused across chunks, states and
+            queries. Created on first use, so requests isn't imported at startup.
+    """
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.mount(
+                "https://", requests.adapters.HTTPAdapter(pool_maxsize=_pool_size)
+            )
+        return _session
+
+
+def dataset_url(src, year, tabletype="detail"):
+    """
+    returns:
+        str: url of a census api dataset, e.g. .../data/2018/acs/acs5/profile
+    """
+
+    if src.startswith("acs3") or (
+        src.startswith(("acs1", "acs5", "acsse")) and year >= 2010
+    ):
+        prefix = "acs/"
+    elif src.startswith("sf1"):
+        prefix = "dec/"
+    else:
+        prefix = ""
+    path = src if tabletype == "detail" else f"{src}/{tabletype}"
+    return f"{API_URL}{year}/{prefix}{path}"
+
+
+def _get(url, params, key, timeout):
+    """
+    returns:
+        List[List]: response rows, the first holding column names
+    """
+
+    # sent unencoded, like censusdata does: the api expects literal ":" and "*"
+    # in geography clauses
+    query = "&".join(f"{name}={value}" for name, value in params.items())
+    key_param = f"&key={key}" if key is not None else ""
+
+    response = session().get(f"{url}?{query}{key_param}", timeout=timeout)
+
+    # the key is left out of error messages, since they're logged
+    if response.status_code != 200:
+        raise CensusApiError(
+            f"census api returned {response.status_code} for {url}?{query}: "
+            f"{response.text[:200]}",
+            response.status_code,
+        )
+    try:
+        return response.json()
+    except ValueError:
+        raise CensusApiError(
+            f"unexpected census api response for {url}?{query}: "
+            f"{response.text[:200]}",
+            response.status_code,
+        )
+
+
+def _convert(values):
+    """
+    Parses a column of strings as ints if possible, otherwise as floats,
+    otherwise leaves it as is.
+    """
+
+    for parse in (int, float):
+        try:
+            return [parse(value) if value is not None else None for value in values]
+        except ValueError:
+            pass
+    return values
+
+
+def download(src, year, geo, var, key=None, tabletype="detail", timeout=None):
+    """
+    Downloads census data, like censusdata.download.
+
+    args:
+        src (str): Census api source, e.g. "acs5"
+        year (int): Year of data
+        geo (censusdata.censusgeo): Geographies to download data for
+        var (List[str]): Census api variable ids
+        key (str): Census api key
+        tabletype (str): "detail", "subject", "profile" or "cprofile"
+        timeout (float): Seconds to wait for the api to connect, and between
+            bytes of its response. None waits indefinitely.
+    returns:
+        Pandas.DataFrame: one row per geography, indexed by censusgeo, one
+            column per variable
+    raises:
+        CensusApiError: if the api answers with an error
+        requests.RequestException: on network errors and timeouts
+    """
+
+    if tabletype not in TABLETYPES:
+        raise ValueError(f"Unknown table type {tabletype}!")
+
+    url = dataset_url(src, year, tabletype)
+
+    columns = {}
+    for start in range(0, len(var), CHUNK_SIZE):
+        params = {"get": ",".join(["NAME"] + var[start : start + CHUNK_SIZE])}
+        params.update(geo.request())
+        header, *rows = _get(url, params, key, timeout)
+        for j, column in enumerate(header):
+            columns[column] = [row[j] for row in rows]
+
+    names = columns["NAME"]
+    geo_columns = [
+        column for column in columns if column != "NAME" and column not in var
+    ]
+    index = [
+        censusdata.censusgeo(
+            [(column, columns[column][i]) for column in geo_columns], names[i]
+        )
+        for i in range(len(names))
+    ]
+
+    return pd.DataFrame(
+        {var_id: _convert(columns[var_id]) for var_id in var if var_id in columns},
+        index=index,
+    )
@@ -0,0 +1,228 @@
+import json
+import sqlite3
+import threading
+import time
+
+from lazy import LazyModule
+from metrics import timed
+
+# only needed to answer queries, so not imported at startup
+pd = LazyModule("pandas")
+censusdata = LazyModule("censusdata")
+
+
+class OfflineCacheMiss(Exception):
+    """
+    Raised when running offline and requested data isn't in the cache.
+    """
+
+
+class CensusCache:
+    """
+    Persistent cache of census api responses, stored in a sqlite database.
+
+    Responses are stored one variable column at a time, keyed by
+    (src, year, state fips, tabletype, variable id), so a query only needs
+    to go out to the census api for the variables that aren't cached yet.
+
+    args:
+        db_path (str): Path to sqlite database file. Created if missing.
+        ttl (float): Seconds a cached column stays valid. None (the default)
+            means cached columns never expire, which is fine for ACS releases
+            since published estimates don't change.
+        max_entries (int): Maximum number of cached columns. Oldest columns are
+            evicted first once this is exceeded. None means no limit.
+    """
+
+    def __init__(self, db_path, ttl=None, max_entries=None):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self.db:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS census_cache (
+                    src text,
+                    year integer,
+                    state_fips text,
+                    tabletype text,
+                    variable text,
+                    fetched_at real,
+                    data text,
+                    PRIMARY KEY (src, year, state_fips, tabletype, variable)
+                );
+                CREATE INDEX IF NOT EXISTS census_cache_fetched_at
+                    ON census_cache (fetched_at);
+            """)
+
+    def _is_fresh(self, fetched_at):
+        return self.ttl is None or time.time() - fetched_at < self.ttl
+
+    @timed("cache_read")
+    def get(self, src, year, state_fips, tabletype, var_ids, allow_stale=False):
+        """
+        Looks up cached columns for one state x tabletype job.
+
+        args:
+            src (str): Census api source parameter
+            year (int): Census api year parameter
+            state_fips (str): fips code of state
+            tabletype (str): Census api table type
+            var_ids (List[str]): Census api variable ids
+            allow_stale (bool): Also return columns older than the ttl, e.g. 
+                when the census api is unavailable
+        returns:
+            (Pandas.DataFrame, List[str]): Dataframe of cached columns (None if
+            nothing was cached), and list of variable ids that still need to
+            be downloaded.
+        """
+
+        with self._lock:
+            cur = self.db.cursor()
+            cur.execute(
+                """
+                SELECT variable, fetched_at, data
+                FROM census_cache
+                WHERE src == ? AND year == ? AND state_fips == ? AND tabletype == ?
+                AND variable IN ({})
+            """.format(", ".join("?" * len(var_ids))),
+                (src, year, state_fips, tabletype, *var_ids),
+            )
+            rows = cur.fetchall()
+            cur.close()
+
+        columns = {}
+        for variable, fetched_at, data in rows:
+            if allow_stale or self._is_fresh(fetched_at):
+                columns[variable] = self._decode_column(state_fips, data)
+
+        missing = [var for var in var_ids if var not in columns]
+
+        if not columns:
+            return None, missing
+
+        return (
+            pd.DataFrame(columns)[[var for var in var_ids if var in columns]],
+            missing,
+        )
+
+    def missing(self, src, year, state_fips, tabletype, var_ids):
+        """
+        Lists variables that aren't cached for one state x tabletype job, without
+        loading the cached data.
+
+        returns:
+            List[str]: variable ids that still need to be downloaded
+        """
+
+        with self._lock:
+            rows = self.db.execute(
+                """
+                SELECT variable, fetched_at
+                FROM census_cache
+                WHERE src == ? AND year == ? AND state_fips == ? AND tabletype == ?
+            """,
+                (src, year, state_fips, tabletype),
+            ).fetchall()
+
+        cached = set(
+            variable for variable, fetched_at in rows if self._is_fresh(fetched_at)
+        )
+        return [var for var in var_ids if var not in cached]
+
+    @timed("cache_write")
+    def put(self, src, year, state_fips, tabletype, df):
+        """
+        Stores each column of a dataframe returned by censusdata.download.
+
+        args:
+            src (str): Census api source parameter
+            year (int): Census api year parameter
+            state_fips (str): fips code of state
+            tabletype (str): Census api table type
+            df (Pandas.DataFrame): Census api response
+        """
+
+        fetched_at = time.time()
+        rows = [
+            (
+                src,
+                year,
+                state_fips,
+                tabletype,
+                variable,
+                fetched_at,
+                self._encode_column(df[variable]),
+            )
+            for variable in df.columns
+        ]
+
+        with self._lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO census_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+        if self.max_entries is not None:
+            self.evict()
+
+    def evict(self):
+        """
+        Deletes expired columns, and the oldest columns past max_entries.
+
+        returns:
+            int: number of deleted columns
+        """
+
+        with self._lock, self.db:
+            deleted = 0
+            if self.ttl is not None:
+                deleted += self.db.execute(
+                    "DELETE FROM census_cache WHERE fetched_at < ?",
+                    (time.time() - self.ttl,),
+                ).rowcount
+
+            if self.max_entries is not None:
+                deleted += self.db.execute(
+                    """
+                    DELETE FROM census_cache
+                    WHERE rowid IN (
+                        SELECT rowid FROM census_cache
+                        ORDER BY fetched_at DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                """,
+                    (self.max_entries,),
+                ).rowcount
+
+        return deleted
+
+    def clear(self):
+        """
+        Deletes all cached columns.
+        """
+
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM census_cache")
+
+    @staticmethod
+    def _encode_column(column):
+        return json.dumps(
+            {
+                "names": [geo.name for geo in column.index],
+                "counties": [geo.params()[-1][1] for geo in column.index],
+                "values": [None if pd.isna(v) else v for v in column.tolist()],
+            }
+        )
+
+    @staticmethod
+    def _decode_column(state_fips, data):
+        data = json.loads(data)
+        index = [
+            censusdata.censusgeo([("state", state_fips), ("county", county)], name)
+            for name, county in zip(data["names"], data["counties"])
+        ]
+        return pd.Series(data["values"], index=index)
@@ -0,0 +1,191 @@
+import zlib
+
+# response types worth compressing; images, parquet and arrow data are either
+# compressed already or don't shrink much
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/x-ndjson",
+    "image/svg+xml",
+)
+
+# responses with a known length below this aren't worth compressing
+MIN_SIZE = 512
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def available_encodings():
+    """
+    returns:
+        List[str]: content encodings this process can produce, preferred first
+    """
+    return (["br"] if _brotli() is not None else []) + ["gzip"]
+
+
+def negotiate(accept_encoding, encodings=None):
+    """
+    Picks a content encoding from an Accept-Encoding header value.
+
+    args:
+        accept_encoding (str): Accept-Encoding request header
+        encodings (List[str]): encodings to choose from, preferred first.
+            Defaults to available_encodings()
+    returns:
+        str: chosen encoding, or None to send the response uncompressed
+    """
+
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().lower().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding] = quality
+
+    for encoding in encodings if encodings is not None else available_encodings():
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+class _Gzip:
+    def __init__(self, level):
+        # wbits 31: gzip container
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, chunk):
+        # sync flush after every chunk, so streamed responses reach the client
+        # as they're generated instead of when the buffer fills
+        return self._compressor.compress(chunk) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self, quality):
+        self._compressor = _brotli().Compressor(quality=quality)
+
+    def compress(self, chunk):
+        return self._compressor.process(chunk) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    WSGI middleware compressing dynamic responses with brotli (if the brotli
+    package is installed) or gzip, whichever the client accepts. Bodies are
+    compressed chunk by chunk, so streamed responses like exports stay
+    streamed.
+
+    Responses that already have a Content-Encoding, aren't a compressible type,
+    or are known to be smaller than MIN_SIZE pass through unchanged. ETags of
+    compressed responses are made weak, since the bytes differ from the
+    uncompressed response's.
+
+    args:
+        app: WSGI application
+        gzip_level (int): zlib compression level, 1-9
+        brotli_quality (int): brotli quality, 0-11. Low values suit responses
+            compressed on every request.
+        exclude_prefixes (Tuple[str]): paths not to compress, e.g. static files
+            served precompressed
+    """
+
+    def __init__(self, app, gzip_level=6, brotli_quality=4, exclude_prefixes=()):
+        self.app = app
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.exclude_prefixes = tuple(exclude_prefixes)
+
+    def __call__(self, environ, start_response):
+        if environ.get("REQUEST_METHOD") == "HEAD" or environ.get(
+            "PATH_INFO", ""
+        ).startswith(self.exclude_prefixes):
+            return self.app(environ, start_response)
+
+        encoding = negotiate(environ.get("HTTP_ACCEPT_ENCODING"))
+        if encoding is None:
+            return self.app(environ, start_response)
+
+        compressor = []
+
+        def compressing_start_response(status, headers, exc_info=None):
+            headers = self._vary(headers)
+            if self._should_compress(status, headers):
+                compressor.append(
+                    _Brotli(self.brotli_quality)
+                    if encoding == "br"
+                    else _Gzip(self.gzip_level)
+                )
+                headers = self._compressed_headers(headers, encoding)
+            return start_response(status, headers, exc_info)
+
+        body = self.app(environ, compressing_start_response)
+        return self._compress_body(body, compressor)
+
+    @staticmethod
+    def _vary(headers):
+        for i, (name, value) in enumerate(headers):
+            if name.lower() == "vary":
+                if "accept-encoding" not in value.lower():
+                    headers[i] = (name, value + ", Accept-Encoding")
+                return headers
+        return headers + [("Vary", "Accept-Encoding")]
+
+    @staticmethod
+    def _should_compress(status, headers):
+        if not status.startswith("200"):
+            return False
+
+        headers = {name.lower(): value for name, value in headers}
+        if "content-encoding" in headers:
+            return False
+        if not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES):
+            return False
+        length = headers.get("content-length")
+        return length is None or int(length) >= MIN_SIZE
+
+    @staticmethod
+    def _compressed_headers(headers, encoding):
+        compressed = [("Content-Encoding", encoding)]
+        for name, value in headers:
+            if name.lower() == "content-length":
+                continue
+            if name.lower() == "etag" and not value.startswith("W/"):
+                value = "W/" + value
+            compressed.append((name, value))
+        return compressed
+
+    @staticmethod
+    def _compress_body(body, compressor):
+        try:
+            for chunk in body:
+                if not compressor:
+                    yield chunk
+                elif chunk:
+                    out = compressor[0].compress(chunk)
+                    if out:
+                        yield out
+            if compressor:
+                yield compressor[0].finish()
+        finally:
+            if hasattr(body, "close"):
+                body.close()
@@ -0,0 +1,117 @@
+import re
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+# minimum share of a query's trigrams a label needs to be a fuzzy match
+MIN_SIMILARITY = 0.5
+
+
+def normalize(text):
+    """
+    Lowercases text and replaces punctuation with spaces, e.g.
+    "St. Mary's Parish, Louisiana" -> "st mary s parish louisiana"
+    """
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", text.lower()).split())
+
+
+def trigrams(text):
+    """
+    Trigrams of each word in normalized text, padded like postgres' pg_trgm so
+    word beginnings weigh more than their middles.
+    """
+    grams = set()
+    for word in text.split():
+        word = f"  {word} "
+        grams.update(word[i : i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+class CountySearchIndex:
+    """
+    Typeahead index over "county, state" labels, built once per geography
+    index.
+
+    Matches are labels with a word starting with each query word (so "alle
+    penn" finds "Allegheny County, Pennsylvania"), labels starting with the
+    whole query first. If there are none, labels sharing most of the query's
+    trigrams are returned instead, which catches typos like "alegheny".
+
+    args:
+        labels (List[str]): "county, state" labels
+    """
+
+    def __init__(self, labels):
+        self.labels = list(labels)
+        self._normalized = [normalize(label) for label in self.labels]
+
+        # sorted (word, label position) pairs, searched by prefix with bisect
+        self._words = sorted(
+            (word, i)
+            for i, label in enumerate(self._normalized)
+            for word in set(label.split())
+        )
+        self._word_keys = [word for word, _ in self._words]
+
+        self._trigrams = defaultdict(list)
+        for i, label in enumerate(self._normalized):
+            for gram in trigrams(label):
+                self._trigrams[gram].append(i)
+
+    def _word_prefix_matches(self, token):
+        matches = set()
+        for j in range(bisect_left(self._word_keys, token), len(self._words)):
+            word, i = self._words[j]
+            if not word.startswith(token):
+                break
+            matches.add(i)
+        return matches
+
+    def search(self, query, limit=20):
+        """
+        args:
+            query (str): text typed by the user
+            limit (int): maximum number of matches
+        returns:
+            List[str]: matching labels, best first
+        """
+
+        query = normalize(query)
+        if not query or limit <= 0:
+            return []
+
+        matches = None
+        for token in query.split():
+            token_matches = self._word_prefix_matches(token)
+            matches = token_matches if matches is None else matches & token_matches
+
+        ranked = sorted(
+            matches,
+            key=lambda i: (
+                not self._normalized[i].startswith(query),
+                self._normalized[i],
+            ),
+        )[:limit]
+
+        # fall back to fuzzy matches when nothing matches by prefix, e.g. typos
+        if not ranked and len(query) >= 3:
+            ranked = self._fuzzy_matches(query, limit)
+
+        return [self.labels[i] for i in ranked]
+
+    def _fuzzy_matches(self, query, limit):
+        query_grams = trigrams(query)
+
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self._trigrams.get(gram, ()))
+
+        scored = []
+        for i, count in shared.items():
+            # like pg_trgm's word_similarity: a short query should match a long
+            # label, so only the query's trigrams count
+            similarity = count / len(query_grams)
+            if similarity >= MIN_SIMILARITY:
+                scored.append((-similarity, len(self.labels[i]), self._normalized[i], i))
+
+        scored.sort()
+        return [i for *_, i in scored[:limit]]
@@ -0,0 +1,217 @@
+import ast
+import operator
+
+import numpy as np
+
+
+class DefinitionError(ValueError):
+    """
+    Raised when a variable definition in the config can't be compiled.
+    """
+
+
+_BINARY_OPS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.FloorDiv: np.floor_divide,
+    ast.Mod: np.mod,
+    ast.Pow: np.power,
+}
+
+_UNARY_OPS = {
+    ast.UAdd: operator.pos,
+    ast.USub: np.negative,
+}
+
+# functions that may be called in a definition, mapped to elementwise versions
+_FUNCTIONS = {
+    "sum": lambda *args: np.add.reduce(args),
+    "min": lambda *args: np.minimum.reduce(args),
+    "max": lambda *args: np.maximum.reduce(args),
+    "abs": np.abs,
+    "round": np.round,
+}
+
+
+class DefinitionPlan:
+    """
+    Compiled form of the definitions in a variable config.
+
+    Every definition is parsed into a graph of numpy operations once. Identical
+    subexpressions (e.g. a denominator shared by several ratios) are stored as a
+    single node, so they are only computed once per evaluation.
+
+    Use compile_definitions() to build a plan.
+    """
+
+    def __init__(self, nodes, outputs, raw_vars):
+        # nodes: list of (op, args) tuples, in dependency order. op is "var",
+        # "const", or a callable applied to the values of the nodes in args
+        self._nodes = nodes
+        # outputs: list of (name, node index), one per config entry
+        self._outputs = outputs
+        self.raw_vars = raw_vars
+
+    def _required_nodes(self, roots):
+        required = set()
+        stack = list(roots)
+        while stack:
+            i = stack.pop()
+            if i in required:
+                continue
+            required.add(i)
+            op, args = self._nodes[i]
+            if op not in ("var", "const"):
+                stack.extend(args)
+        return sorted(required)
+
+    def evaluate(self, df, var_ids):
+        """
+        Evaluates the definitions of the selected variables over a dataframe
+        of raw census data.
+
+        args:
+            df (Pandas.DataFrame): Raw data, one column per census api variable
+            var_ids (List[int]): Ids (positions in the config) of the variables
+                to compute
+        returns:
+            (List[str], numpy.ndarray): Column names, and a (rows x columns)
+            array of computed values
+        """
+
+        outputs = [self._outputs[i] for i in var_ids]
+
+        required = self._required_nodes(node for _, node in outputs)
+
+        # all raw columns are converted in one pass; definitions are evaluated
+        # on columns of this matrix
+        columns = sorted(
+            set(self._nodes[i][1] for i in required if self._nodes[i][0] == "var")
+        )
+        matrix = df[columns].to_numpy()
+        column_index = {var: j for j, var in enumerate(columns)}
+
+        values = {}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for i in required:
+                op, args = self._nodes[i]
+                if op == "var":
+                    values[i] = matrix[:, column_index[args]]
+                elif op == "const":
+                    values[i] = args
+                else:
+                    values[i] = op(*(values[arg] for arg in args))
+
+        names = [name for name, _ in outputs]
+        if not outputs:
+            return names, np.empty((len(df), 0))
+
+        result = np.column_stack(
+            [np.broadcast_to(values[node], (len(df),)) for _, node in outputs]
+        )
+
+        return names, result
+
+
+class _PlanBuilder:
+    def __init__(self):
+        self.nodes = []
+        self.node_ids = {}
+        self.raw_vars = set()
+
+    def add(self, key, op, args):
+        if key not in self.node_ids:
+            self.node_ids[key] = len(self.nodes)
+            self.nodes.append((op, args))
+        return self.node_ids[key]
+
+    def compile(self, node, allowed_vars):
+        """
+        Adds an expression's nodes to the plan.
+
+        returns:
+            (int, Hashable): node index, and a canonical key for the expression
+        """
+
+        if isinstance(node, ast.Name):
+            if node.id not in allowed_vars:
+                raise DefinitionError(
+                    "'{}' is not listed in the variable's vars".format(node.id)
+                )
+            self.raw_vars.add(node.id)
+            key = ("var", node.id)
+            return self.add(key, "var", node.id), key
+
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            key = ("const", node.value)
+            return self.add(key, "const", node.value), key
+
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+            left, left_key = self.compile(node.left, allowed_vars)
+            right, right_key = self.compile(node.right, allowed_vars)
+            key = (type(node.op).__name__, left_key, right_key)
+            return self.add(key, _BINARY_OPS[type(node.op)], (left, right)), key
+
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+            operand, operand_key = self.compile(node.operand, allowed_vars)
+            key = (type(node.op).__name__, operand_key)
+            return self.add(key, _UNARY_OPS[type(node.op)], (operand,)), key
+
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id in _FUNCTIONS
+            and not node.keywords
+        ):
+            # sum([a, b]) and sum(a, b) are treated the same
+            args = node.args
+            if len(args) == 1 and isinstance(args[0], (ast.List, ast.Tuple)):
+                args = args[0].elts
+
+            compiled = [self.compile(arg, allowed_vars) for arg in args]
+            key = (node.func.id, tuple(arg_key for _, arg_key in compiled))
+            return (
+                self.add(
+                    key,
+                    _FUNCTIONS[node.func.id],
+                    tuple(arg for arg, _ in compiled),
+                ),
+                key,
+            )
+
+        raise DefinitionError("unsupported expression '{}'".format(ast.unparse(node)))
+
+
+def compile_definitions(config):
+    """
+    Parses and validates the definitions in a variable config.
+
+    Definitions may use arithmetic operators, numeric constants, the functions
+    sum, min, max, abs and round, and the census variable ids listed in the
+    variable's vars field.
+
+    args:
+        config (List[Dict]): Variable config, as returned by load_config
+    returns:
+        DefinitionPlan
+    raises:
+        DefinitionError: if a definition is not valid
+    """
+
+    builder = _PlanBuilder()
+    outputs = []
+
+    for var in config:
+        try:
+            tree = ast.parse(var["definition"].strip(), mode="eval")
+            node, _ = builder.compile(tree.body, set(var["vars"]))
+        except (SyntaxError, DefinitionError) as e:
+            raise DefinitionError(
+                "Invalid definition for variable '{}': {}".format(var["name"], e)
+            ) from e
+
+        outputs.append((var["name"], node))
+
+    return DefinitionPlan(builder.nodes, outputs, sorted(builder.raw_vars))
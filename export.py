@@ -0,0 +1,150 @@
+import io
+import json
+
+# rows written per chunk of streamed output
+CHUNK_ROWS = 64
+
+
+def _chunks(df, chunk_rows):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start : start + chunk_rows]
+
+
+def iter_csv(df, chunk_rows=CHUNK_ROWS):
+    """
+    Yields a dataframe as csv, one chunk of rows at a time.
+    """
+
+    yield df.iloc[:0].to_csv(index=False)
+    for chunk in _chunks(df, chunk_rows):
+        yield chunk.to_csv(index=False, header=False)
+
+
+def iter_jsonl(df, chunk_rows=CHUNK_ROWS):
+    """
+    Yields a dataframe as json lines, one object per row.
+    """
+
+    for chunk in _chunks(df, chunk_rows):
+        yield "".join(
+            json.dumps(row, default=_json_default) + "\n"
+            for row in chunk.to_dict(orient="records")
+        )
+
+
+def _json_default(value):
+    # numpy scalars
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"{type(value)} is not json serializable")
+
+
+def _record_batches(df, chunk_rows):
+    import pyarrow as pa
+
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    for chunk in _chunks(df, chunk_rows):
+        yield schema, pa.RecordBatch.from_pandas(
+            chunk, schema=schema, preserve_index=False
+        )
+
+
+class _StreamSink(io.RawIOBase):
+    """
+    Write-only file object that hands written bytes back out in chunks. Keeps
+    track of its own position, since writers ask for it to record offsets.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def iter_arrow(df, chunk_rows=CHUNK_ROWS):
+    """
+    Yields a dataframe in the Arrow IPC streaming format, one record batch per
+    chunk of rows. Requires pyarrow.
+    """
+
+    import pyarrow as pa
+
+    sink = _StreamSink()
+    writer = None
+    for schema, batch in _record_batches(df, chunk_rows):
+        if writer is None:
+            writer = pa.ipc.new_stream(sink, schema)
+        writer.write_batch(batch)
+        yield sink.drain()
+
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+def iter_parquet(df, chunk_rows=CHUNK_ROWS):
+    """
+    Yields a dataframe as a parquet file, one row group per chunk of rows.
+    Requires pyarrow.
+    """
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _StreamSink()
+    writer = None
+    for schema, batch in _record_batches(df, chunk_rows):
+        if writer is None:
+            writer = pq.ParquetWriter(sink, schema)
+        writer.write_table(pa.Table.from_batches([batch]))
+        yield sink.drain()
+
+    if writer is not None:
+        # the footer is only written on close
+        writer.close()
+        yield sink.drain()
+
+
+def format_available(fmt):
+    """
+    Checks whether an export format is known, and its optional dependencies
+    are installed.
+    """
+
+    if fmt not in EXPORT_FORMATS:
+        return False
+
+    if fmt in ("arrow", "parquet"):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return False
+
+    return True
+
+
+"""
+    Supported export formats: format name -> (generator, mimetype, file extension)
+"""
+EXPORT_FORMATS = {
+    "csv": (iter_csv, "text/csv", "csv"),
+    "jsonl": (iter_jsonl, "application/x-ndjson", "jsonl"),
+    "arrow": (iter_arrow, "application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": (iter_parquet, "application/vnd.apache.parquet", "parquet"),
+}
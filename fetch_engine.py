@@ -0,0 +1,105 @@
+import atexit
+import contextvars
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+CENSUS_API_HOST = "api.census.gov"
+
+
+class FetchEngine:
+    """
+    Long-lived thread pool for running census api downloads.
+
+    Census api queries are network bound, so threads are enough to run them in
+    parallel. One engine should be created at startup and shared by every
+    request, instead of starting a new process pool per request.
+
+    args:
+        max_workers (int): Number of worker threads
+        per_host_limit (int): Maximum number of concurrent calls to a single
+            host. Keeps a burst of requests from opening more connections to
+            the census api than it will tolerate.
+    """
+
+    def __init__(self, max_workers=8, per_host_limit=4):
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="census-fetch"
+        )
+        self._host_limits = defaultdict(
+            lambda: threading.BoundedSemaphore(self.per_host_limit)
+        )
+        self._host_limits_lock = threading.Lock()
+        # key -> future of the job currently running for it (see submit_shared)
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+        atexit.register(self.shutdown)
+
+    def _host_limit(self, host):
+        with self._host_limits_lock:
+            return self._host_limits[host]
+
+    def _run(self, host, fn, args):
+        with self._host_limit(host):
+            return fn(*args)
+
+    def submit(self, fn, *args, host=CENSUS_API_HOST):
+        """
+        Schedules fn(*args) on the shared pool. fn runs in a copy of the caller's 
+        context, so per-request state like metrics spans carries over.
+
+        args:
+            fn (Callable): function to run
+            host (str): host contacted by fn, used for per-host concurrency limits
+        returns:
+            concurrent.futures.Future
+        """
+
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, self._run, host, fn, args)
+
+    def submit_shared(self, key, fn, *args, host=CENSUS_API_HOST):
+        """
+        Like submit, but coalesces identical jobs: while a job with the same key
+        is in flight, every caller gets that job's future instead of starting a
+        duplicate. Once it finishes, the next call with the key runs fn again.
+
+        args:
+            key (Hashable): identifies the job, e.g. its normalized arguments
+            fn (Callable): function to run
+            host (str): host contacted by fn, used for per-host concurrency limits
+        returns:
+            concurrent.futures.Future: shared by all callers of the job
+        """
+
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            future = self._inflight[key] = self.submit(fn, *args, host=host)
+
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def _forget(self, key, future):
+        with self._inflight_lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def starmap(self, fn, jobs, host=CENSUS_API_HOST):
+        """
+        Runs fn(*job) for each job in parallel, like multiprocessing.Pool.starmap.
+
+        returns:
+            list: results, in the same order as jobs
+        """
+
+        futures = [self.submit(fn, *job, host=host) for job in jobs]
+        return [future.result() for future in futures]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,19 @@
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for a module that is imported when one of its attributes is first
+    used, e.g. `pd = LazyModule("pandas")`. Keeps heavy libraries that are only
+    needed to answer queries out of app startup.
+
+    args:
+        name (str): Full name of the module to import
+    """
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        # later lookups find the module's attributes directly
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
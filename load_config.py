@@ -1,5 +1,11 @@
-import jsonschema
 import json
+import os
+
+from definitions import compile_definitions, DefinitionError
+from lazy import LazyModule
+
+# not needed when the config comes from a startup snapshot (see snapshot.py)
+jsonschema = LazyModule("jsonschema")
 
 
 """
@@ -17,15 +23,35 @@ CONFIG_SCHEMA = {
             "definition": {"type": "string", "minLength": 3},
             "description": {"type": "string"},
             "category": {"type": "string"},
+            "rollup": {"type": "string", "enum": ["sum", "none"]},
         },
         "required": ["name", "vars", "definition", "category"],
     },
 }
 
 
-def load_config(path: str) -> dict:
+class VariableConfig(list):
     """
-    Validates and loads the variable config file stored in path.
+    A loaded variable config: the list of variable dicts in vars.json, with its
+    compiled definitions (a definitions.DefinitionPlan) as plan, so they're
+    only compiled once. plan is None for configs that weren't compiled, e.g.
+    ones unpickled from a startup snapshot.
+    """
+
+    def __init__(self, variables, plan=None):
+        super().__init__(variables)
+        self.plan = plan
+
+    def __reduce__(self):
+        # plans can hold lambdas, which can't be pickled
+        return (VariableConfig, (list(self),))
+
+
+def load_config(path: str) -> VariableConfig:
+    """
+    Validates and loads the variable config file stored in path. Variable
+    definitions are compiled too, so a bad definition fails here instead of when
+    it's first queried, and the compiled plan is returned with the config.
     """
 
     try:
@@ -41,8 +67,43 @@ def load_config(path: str) -> dict:
         print("Failed to load config: {} is not a valid config".format(path))
         raise e
 
+    try:
+        plan = compile_definitions(config)
+    except DefinitionError as e:
+        print("Failed to load config: {} is not a valid config".format(path))
+        raise e
+
+    return VariableConfig(config, plan)
+
+
+_config_cache = {}
+
+
+def load_config_cached(path: str) -> VariableConfig:
+    """
+    Same as load_config, but reuses the previously loaded config until the file's
+    modification time changes. Callers can compare the returned object by
+    identity to tell whether the config was reloaded.
+    """
+
+    mtime = os.stat(path).st_mtime_ns
+
+    cached = _config_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    config = load_config(path)
+    _config_cache[path] = (mtime, config)
     return config
 
 
+def seed_config_cache(path: str, config: dict):
+    """
+    Makes load_config_cached return config, which must already be validated 
+    (e.g. loaded from a startup snapshot), until the file at path changes.
+    """
+    _config_cache[path] = (os.stat(path).st_mtime_ns, config)
+
+
 if __name__ == "__main__":
     load_config("vars.json")
@@ -0,0 +1,281 @@
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+from lazy import LazyModule
+
+# only needed to answer queries, so not imported at startup
+pd = LazyModule("pandas")
+censusdata = LazyModule("censusdata")
+
+
+def county_code(state_fips, county_fips):
+    """
+    Combines state and county fips codes into one integer, e.g. ("42", "003")
+    -> 42003
+    """
+    return int(state_fips) * 1000 + int(county_fips)
+
+
+# rollup rows are coded like counties: county_code(state_fips, 0) for a state,
+# and NATION_CODE for the whole country
+NATION_CODE = 0
+
+
+def state_code(state_fips):
+    """
+    Rollup code of a state, e.g. "42" -> 42000
+    """
+    return county_code(state_fips, 0)
+
+
+class CountyMatrixStore:
+    """
+    Read-only county x variable matrix of raw census data for one src and year.
+
+    Values are stored in a .npy file that is memory mapped, so every worker
+    process on a host shares one copy through the page cache, plus a small json
+    index of row (county) and column (variable) labels. Build one with
+    CountyMatrixStore.build after populating the census cache.
+
+    Stores also hold precomputed rollups, the sums of each variable over every
+    state and over the nation, in a second matrix. Only summable counts are
+    meaningful there; see CensusViewer.query_rollup.
+
+    Each build writes its matrices under a new version, <path>.<version>.npy
+    and <path>.<version>.rollups.npy, and then replaces the index,
+    <path>.json, which names the version to read. Replacing the index is the
+    only step that changes which files a store opens, so a store is never
+    opened half rebuilt.
+
+    args:
+        path (str): Path prefix of the store
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path + ".json", "r") as f:
+            index = json.load(f)
+
+        self.src = index["src"]
+        self.year = index["year"]
+        self.counties = np.array(index["counties"], dtype=np.int64)
+        self.names = index["names"]
+        self.variables = index["variables"]
+        self._integer_vars = set(index["integer_variables"])
+        self._columns = {var: j for j, var in enumerate(self.variables)}
+
+        data_path = self._data_path(path, index.get("version"))
+        self.matrix = np.load(data_path + ".npy", mmap_mode="r")
+
+        # stores built before rollups were added don't have them
+        if "rollups" in index:
+            self.rollups = np.array(index["rollups"], dtype=np.int64)
+            self.rollup_matrix = np.load(data_path + ".rollups.npy", mmap_mode="r")
+        else:
+            self.rollups = None
+            self.rollup_matrix = None
+
+    def has_vars(self, var_ids):
+        return all(var in self._columns for var in var_ids)
+
+    def rows(self, county_codes):
+        """
+        Row positions of counties in the matrix.
+
+        args:
+            county_codes (List[int]): county codes (see county_code)
+        returns:
+            numpy.ndarray
+        """
+        return self._positions(self.counties, county_codes, "county")
+
+    @staticmethod
+    def _positions(labels, codes, kind):
+        codes = np.asarray(codes, dtype=np.int64)
+        rows = np.searchsorted(labels, codes)
+        rows = np.minimum(rows, len(labels) - 1)
+        if not np.array_equal(labels[rows], codes):
+            raise KeyError(f"{kind} missing from matrix store")
+        return rows
+
+    def slice(self, county_codes, var_ids):
+        """
+        Reads raw data for selected counties and variables. Only the selected
+        cells are read from the mapped file.
+
+        args:
+            county_codes (List[int]): county codes (see county_code)
+            var_ids (List[str]): census api variable ids
+        returns:
+            Pandas.DataFrame: one row per county, indexed by censusgeo like
+                censusdata.download output, one column per variable
+        """
+
+        var_ids = list(dict.fromkeys(var_ids))
+        rows = self.rows(county_codes)
+        columns = [self._columns[var] for var in var_ids]
+
+        values = self.matrix[np.ix_(rows, columns)]
+
+        index = [
+            censusdata.censusgeo(
+                [("state", f"{code // 1000:02d}"), ("county", f"{code % 1000:03d}")],
+                self.names[row],
+            )
+            for code, row in zip(self.counties[rows].tolist(), rows.tolist())
+        ]
+
+        return self._restore_integers(
+            pd.DataFrame(values, index=index, columns=var_ids)
+        )
+
+    def slice_rollups(self, rollup_codes, var_ids):
+        """
+        Reads precomputed rollups for selected states (or the nation) and
+        variables.
+
+        args:
+            rollup_codes (List[int]): rollup codes (see state_code, NATION_CODE)
+            var_ids (List[str]): census api variable ids
+        returns:
+            Pandas.DataFrame: one row per rollup, indexed by rollup code, one
+                column per variable
+        """
+
+        if self.rollup_matrix is None:
+            raise KeyError("matrix store has no rollups; rebuild it")
+
+        var_ids = list(dict.fromkeys(var_ids))
+        rows = self._positions(self.rollups, rollup_codes, "rollup")
+        columns = [self._columns[var] for var in var_ids]
+
+        return self._restore_integers(
+            pd.DataFrame(
+                self.rollup_matrix[np.ix_(rows, columns)],
+                index=pd.Index(rollup_codes, name="rollup"),
+                columns=var_ids,
+            )
+        )
+
+    def _restore_integers(self, df):
+        """
+        Casts columns of integer variables back to int, unless they have
+        missing values. Values are stored as float64 so they can hold NaN.
+        """
+
+        for var in df.columns:
+            if var in self._integer_vars and not df[var].isna().any():
+                df[var] = df[var].astype(np.int64)
+        return df
+
+    @classmethod
+    def build(cls, path, cache, geo_db, src, year, tabletype_vars):
+        """
+        Writes a matrix store from data in the census cache.
+
+        args:
+            path (str): Path prefix of the store
+            cache (census_cache.CensusCache): Census cache holding the data
+            geo_db (census.GeoDB): Geography names and fips codes
+            src (str): Census api source parameter
+            year (int): Census api year parameter
+            tabletype_vars (List[Tuple[str, List[str]]]): tabletype, variable ids
+                pairs to include
+        returns:
+            CountyMatrixStore
+        """
+
+        state_frames = []
+        for state in geo_db.get_states():
+            state_fips = geo_db.get_state_fips(state)
+            frames = []
+            for tabletype, var_ids in tabletype_vars:
+                cached_df, missing = cache.get(src, year, state_fips, tabletype, var_ids)
+                if missing:
+                    raise LookupError(
+                        f"{len(missing)} variables for state {state_fips} are not "
+                        "cached. Run warm_cache.py first."
+                    )
+                frames.append(cached_df)
+            state_frames.append(pd.concat(frames, axis=1))
+
+        df = pd.concat(state_frames)
+        codes = [county_code(geo.params()[0][1], geo.params()[1][1]) for geo in df.index]
+        df = df.assign(_code=codes, _name=[geo.name for geo in df.index])
+        df = df.sort_values("_code")
+
+        variables = [var for var in df.columns if var not in ("_code", "_name")]
+        integer_vars = [
+            var for var in variables if pd.api.types.is_integer_dtype(df[var])
+        ]
+
+        values = df[variables].to_numpy(dtype=np.float64)
+
+        # rollups: counties are sorted by code, so each state's counties are
+        # contiguous. A sum is missing if any of its counties' values is
+        # missing, since NaN propagates through the sums. Negative values are
+        # census annotation codes (e.g. -666666666), not counts, so they count
+        # as missing
+        codes = df["_code"].to_numpy()
+        state_codes = codes // 1000 * 1000
+        starts = np.flatnonzero(np.r_[True, state_codes[1:] != state_codes[:-1]])
+        counts = np.where(values < 0, np.nan, values)
+        rollups = np.vstack(
+            [counts.sum(axis=0, keepdims=True), np.add.reduceat(counts, starts)]
+        )
+        rollup_codes = [NATION_CODE] + state_codes[starts].tolist()
+
+        # the new version's files are written in full before the index points
+        # at them. Processes that have the old files mapped keep reading them
+        version = f"{time.time_ns():x}"
+        data_path = cls._data_path(path, version)
+        np.save(path + ".tmp.npy", values)
+        os.replace(path + ".tmp.npy", data_path + ".npy")
+        np.save(path + ".tmp.rollups.npy", rollups)
+        os.replace(path + ".tmp.rollups.npy", data_path + ".rollups.npy")
+        with open(path + ".tmp.json", "w") as f:
+            json.dump(
+                {
+                    "version": version,
+                    "src": src,
+                    "year": year,
+                    "counties": df["_code"].tolist(),
+                    "names": df["_name"].tolist(),
+                    "variables": variables,
+                    "integer_variables": integer_vars,
+                    "rollups": rollup_codes,
+                },
+                f,
+            )
+        try:
+            with open(path + ".json", "r") as f:
+                previous = json.load(f).get("version")
+        except FileNotFoundError:
+            previous = None
+        os.replace(path + ".tmp.json", path + ".json")
+
+        # the previous version is kept, for processes that read the old index
+        # but haven't mapped its files yet
+        keep = {
+            cls._data_path(path, kept) + suffix
+            for kept in (version, previous)
+            for suffix in (".npy", ".rollups.npy")
+        }
+        for old_path in glob.glob(glob.escape(path) + ".*npy"):
+            if old_path not in keep:
+                os.remove(old_path)
+
+        return cls(path)
+
+    @staticmethod
+    def _data_path(path, version):
+        """
+        Path prefix of a version's matrix files. Stores built before versions
+        were added have unversioned files.
+        """
+        return path if version is None else f"{path}.{version}"
@@ -0,0 +1,200 @@
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+"""
+    Histogram bucket upper bounds, in seconds
+"""
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    """
+    Prometheus-style histogram, with one series per combination of label values.
+
+    args:
+        name (str): Metric name
+        description (str): Help text
+        label_names (Tuple[str]): Names of the labels each observation carries
+    """
+
+    def __init__(self, name, description, label_names, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        # label values -> [bucket counts..., count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self):
+        """
+        returns:
+            List[str]: lines in the Prometheus text exposition format
+        """
+
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = sorted(self._series.items())
+
+        for label_values, counts in series:
+            labels = ",".join(
+                '{}="{}"'.format(name, _escape(value))
+                for name, value in zip(self.label_names, label_values)
+            )
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            cumulative += counts[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {counts[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+STAGE_SECONDS = Histogram(
+    "census_stage_seconds", "Time spent in each stage of a query", ("stage",)
+)
+REQUEST_SECONDS = Histogram(
+    "http_request_seconds",
+    "Time spent handling http requests",
+    ("endpoint", "method", "status"),
+)
+
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+# (phase, seconds) pairs, in the order this process went through them
+_startup_phases = []
+
+
+def start_request():
+    """
+    Starts collecting spans for the current request (see request_spans).
+    """
+    _request_spans.set([])
+
+
+def request_spans():
+    """
+    returns:
+        List[Tuple[str, float]]: (stage, seconds) pairs recorded since
+        start_request, in the current context
+    """
+    spans = _request_spans.get()
+    return list(spans) if spans is not None else []
+
+
+@contextmanager
+def span(stage):
+    """
+    Times the enclosed block, recording it in the stage histogram and in the
+    current request's spans.
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def timed(stage):
+    """
+    Decorator version of span.
+    """
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_startup_phase(phase, seconds):
+    _startup_phases.append((phase, seconds))
+
+
+@contextmanager
+def startup_phase(phase):
+    """
+    Times one phase of app startup (see startup_phases).
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup_phase(phase, time.perf_counter() - start)
+
+
+def startup_phases():
+    """
+    returns:
+        List[Tuple[str, float]]: (phase, seconds) pairs recorded during startup
+    """
+    return list(_startup_phases)
+
+
+def server_timing_header(spans):
+    """
+    Formats spans as a Server-Timing header value. Spans of the same stage are
+    summed; desc holds how many there were. Stages that ran in parallel (like
+    census downloads) can add up to more than the request's wall time.
+    """
+
+    totals = {}
+    for stage, elapsed in spans:
+        total, count = totals.get(stage, (0.0, 0))
+        totals[stage] = (total + elapsed, count + 1)
+
+    return ", ".join(
+        f'{stage};dur={total * 1000:.1f};desc="{count}x"'
+        for stage, (total, count) in totals.items()
+    )
+
+
+def render_prometheus():
+    """
+    returns:
+        str: all metrics of this process, in the Prometheus text format
+    """
+    lines = STAGE_SECONDS.render() + REQUEST_SECONDS.render()
+
+    lines += [
+        "# HELP app_startup_seconds Time spent in each phase of app startup",
+        "# TYPE app_startup_seconds gauge",
+    ] + [
+        f'app_startup_seconds{{phase="{_escape(phase)}"}} {seconds}'
+        for phase, seconds in _startup_phases
+    ]
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def query_key(
+    county_names,
+    selected_var_ids,
+    src="acs5",
+    year=2018,
+    geo_type="county",
+    config_version=None,
+):
+    """
+    Builds a content hash identifying the result of a query.
+
+    args:
+        county_names (List[List[str, str]]): List of state, county name pairs
+        selected_var_ids (List[str]): Ids of selected variables
+        src (str or List[str]): Census api source parameter(s)
+        year (int or List[int]): Census api year parameter(s)
+        geo_type (str): "county", or the type of geography the counties are
+            rolled up into (see CensusViewer.query_rollup)
+        config_version (str): Version of the variable config the ids refer to
+            (see CensusViewer.config_version), so results built from an older
+            vars.json aren't reused
+    returns:
+        str: hex digest
+    raises:
+        ValueError: if a variable id isn't an integer
+    """
+
+    srcs = [src] if isinstance(src, str) else list(src)
+    years = [year] if isinstance(year, (int, str)) else list(year)
+
+    normalized = {
+        # county order determines column order of the result, so it's kept
+        "counties": [[state.strip(), county.strip()] for state, county in county_names],
+        "vars": sorted(set(str(var_id) for var_id in selected_var_ids), key=int),
+    }
+    if len(srcs) == 1 and len(years) == 1:
+        # same keys as before multi-year queries
+        normalized.update(src=srcs[0], year=int(years[0]))
+    else:
+        # vintage order determines column order too
+        normalized["vintages"] = list(
+            dict.fromkeys((s, int(y)) for s in srcs for y in years)
+        )
+    if geo_type != "county":
+        normalized["geo_type"] = geo_type
+    if config_version is not None:
+        normalized["config_version"] = config_version
+    return hashlib.sha256(
+        json.dumps(normalized, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+class MemoryResultStore:
+    """
+    In-process LRU store of query results. Results are only visible to the
+    process that stored them.
+
+    args:
+        max_entries (int): Number of results to keep
+    """
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        returns:
+            census.QueryResult: stored result, or None
+        """
+        with self._lock:
+            if key not in self._results:
+                return None
+            self._results.move_to_end(key)
+            return self._results[key]
+
+    def put(self, key, result):
+        """
+        args:
+            key (str): result key, see query_key
+            result (census.QueryResult): result to store
+        """
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+
+class SQLiteResultStore:
+    """
+    Query result store backed by a sqlite database file, so results can be
+    shared by all worker processes on a host. Least recently used results are
+    evicted past max_entries.
+
+    Results are stored pickled, and unpickling runs whatever the database file
+    holds, so the file must only be writable by the app.
+
+    args:
+        db_path (str): Path to sqlite database file. Created if missing.
+        max_entries (int): Number of results to keep
+    """
+
+    def __init__(self, db_path, max_entries=1024):
+        self.db_path = db_path
+        self.max_entries = max_entries
+
+        self.db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+
+        with self._lock, self.db:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key text PRIMARY KEY,
+                    used_at real,
+                    data blob
+                )
+            """)
+
+    def get(self, key):
+        """
+        returns:
+            census.QueryResult: stored result, or None
+        """
+        with self._lock, self.db:
+            row = self.db.execute(
+                "SELECT data FROM results WHERE key == ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.db.execute(
+                "UPDATE results SET used_at = ? WHERE key == ?", (time.time(), key)
+            )
+
+        return pickle.loads(row[0])
+
+    def put(self, key, result):
+        """
+        args:
+            key (str): result key, see query_key
+            result (census.QueryResult): result to store
+        """
+        data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+
+        with self._lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                (key, time.time(), data),
+            )
+            self.db.execute(
+                """
+                DELETE FROM results
+                WHERE key IN (
+                    SELECT key FROM results
+                    ORDER BY used_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+            """,
+                (self.max_entries,),
+            )
@@ -0,0 +1,145 @@
+"""
+    Startup snapshot: the validated variable config and the geography index
+    (including the county selector's choices), pickled so app startup needn't
+    validate vars.json or read geos.db.
+
+    A snapshot records sha256 digests of the files it was built from, and is
+    ignored if either has changed since, so a stale snapshot only costs a
+    normal startup.
+
+        python3 snapshot.py build     # writes startup_snapshot.pickle
+        python3 snapshot.py report    # import-time and startup-time breakdowns
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import re
+import subprocess
+import sys
+
+SNAPSHOT_VERSION = 1
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def build_snapshot(path, config_path, geo_db_path):
+    """
+    Validates the config, loads the geography index, and writes both to path.
+    """
+
+    from census import GeoDB
+    from load_config import load_config
+
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "digests": {
+            "config": file_digest(config_path),
+            "geo_db": file_digest(geo_db_path),
+        },
+        "config": load_config(config_path),
+        "geo_index": GeoDB(geo_db_path).export_index(),
+    }
+
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+
+def load_snapshot(path, config_path, geo_db_path):
+    """
+    Loads a snapshot written by build_snapshot. Snapshots are pickles, so only
+    load ones built locally.
+
+    returns:
+        dict: with "config" and "geo_index" keys, or None if there's no
+            snapshot at path or it doesn't match the current files
+    """
+
+    if not os.path.isfile(path):
+        return None
+
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+
+    if snapshot.get("version") != SNAPSHOT_VERSION or snapshot["digests"] != {
+        "config": file_digest(config_path),
+        "geo_db": file_digest(geo_db_path),
+    }:
+        return None
+
+    return snapshot
+
+
+def import_times(module):
+    """
+    Imports module in a fresh interpreter with -X importtime.
+
+    returns:
+        (List[Tuple[str, int, float]], List[Tuple[str, float]]): (module, depth,
+            cumulative seconds) for every import, and the app's startup phases
+    """
+
+    out = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import json, {module}, metrics; "
+            "print(json.dumps(metrics.startup_phases()))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    imports = []
+    for line in out.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)", line)
+        if match:
+            cumulative, indent, name = match.groups()
+            imports.append((name, (len(indent) - 1) // 2, int(cumulative) / 1e6))
+
+    return imports, json.loads(out.stdout.splitlines()[-1])
+
+
+def report(module="app", top=15):
+    imports, phases = import_times(module)
+
+    print(f"Slowest imports under {module} (cumulative):")
+    nested = sorted(
+        (item for item in imports if 1 <= item[1] <= 2),
+        key=lambda item: item[2],
+        reverse=True,
+    )
+    for name, depth, seconds in nested[:top]:
+        print(f"  {seconds * 1000:8.1f} ms  {'  ' * (depth - 1)}{name}")
+
+    print("Startup phases:")
+    for phase, seconds in phases:
+        print(f"  {seconds * 1000:8.1f} ms  {phase}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the startup snapshot, or report startup timings"
+    )
+    parser.add_argument("command", choices=["build", "report"])
+    parser.add_argument("--path", default="startup_snapshot.pickle")
+    parser.add_argument("--config", default="vars.json")
+    parser.add_argument("--geo-db", default="geos.db")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_snapshot(args.path, args.config, args.geo_db)
+        print(f"Wrote {args.path}")
+    else:
+        report()
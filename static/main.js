@@ -1,5 +1,55 @@
-
 $(document).ready(function () {
     $.fn.selectpicker.Constructor.DEFAULTS.whiteList.a.push('data-toggle');
     $("body").tooltip({ selector: '[data-toggle=tooltip]' });
-});
\ No newline at end of file
+});
+
+// The county selector only renders selected counties. Matches for the search
+// box are loaded from /api/counties as the user types.
+(function () {
+    var timer = null;
+    var latest = 0;
+
+    function showCounties(select, query, counties) {
+        // keep selected counties, replace everything else with the matches
+        select.find("option:not(:selected)").remove();
+        select.find("optgroup:not(:has(option))").remove();
+
+        var present = {};
+        select.find("option").each(function () {
+            present[this.value] = true;
+        });
+
+        counties.forEach(function (county) {
+            if (!present[county]) {
+                // data-tokens makes bootstrap-select's own filter keep fuzzy
+                // matches that don't contain the typed text
+                $("<option>").val(county).text(county)
+                    .attr("data-tokens", query)
+                    .appendTo(select);
+            }
+        });
+
+        select.selectpicker("refresh");
+    }
+
+    $(document).on("input", ".bootstrap-select .bs-searchbox input", function () {
+        var select = $(this).closest(".bootstrap-select").find("select");
+        if (select.attr("id") !== "geoSelector") {
+            return;
+        }
+
+        var query = $(this).val();
+        clearTimeout(timer);
+        timer = setTimeout(function () {
+            var request = ++latest;
+            fetch("/api/counties?q=" + encodeURIComponent(query))
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    // ignore responses to searches the user has typed past
+                    if (request === latest) {
+                        showCounties(select, query, data.counties);
+                    }
+                });
+        }, 150);
+    });
+})();
@@ -0,0 +1,185 @@
+// Virtualized results table. Only the county columns scrolled into view are
+// rendered, and they're fetched from /table-data a page of columns at a time,
+// for the selected category. If the server answering doesn't have the result
+// stored, the page is requested again with the selection, to recompute it.
+(function () {
+    var NAME_WIDTH = 280;
+    var COLUMN_WIDTH = 180;
+    // columns rendered past each edge of the viewport, so scrolling stays smooth
+    var OVERSCAN = 4;
+
+    function ResultsTable(container) {
+        this.container = container;
+        this.url = container.dataset.url;
+        this.selection = JSON.parse(container.dataset.selection);
+        this.columnCount = parseInt(container.dataset.columnCount, 10);
+        this.pageColumns = parseInt(container.dataset.pageColumns, 10);
+        this.category = container.querySelector(".results-category");
+        this.viewport = container.querySelector(".results-viewport");
+        this.sizer = container.querySelector(".results-sizer");
+        this.table = container.querySelector(".results-window");
+        // "category:page" -> page json, or a promise while it's loading
+        this.pages = {};
+        this.renders = 0;
+
+        this.sizer.style.width = NAME_WIDTH + this.columnCount * COLUMN_WIDTH + "px";
+
+        var render = this.render.bind(this);
+        var scheduled = false;
+        this.viewport.addEventListener("scroll", function () {
+            if (!scheduled) {
+                scheduled = true;
+                requestAnimationFrame(function () {
+                    scheduled = false;
+                    render();
+                });
+            }
+        });
+        window.addEventListener("resize", render);
+        this.category.addEventListener("change", render);
+
+        render();
+    }
+
+    ResultsTable.prototype.page = function (category, page) {
+        var key = category + ":" + page;
+        if (!this.pages[key]) {
+            var self = this;
+            var url = this.url + "?" + new URLSearchParams({
+                category: category,
+                col_start: page * this.pageColumns,
+                col_count: this.pageColumns
+            });
+            this.pages[key] = fetch(url)
+                .then(function (response) {
+                    if (response.status === 404) {
+                        return fetch(url, {
+                            method: "POST",
+                            body: selectionBody(self.selection)
+                        });
+                    }
+                    return response;
+                })
+                .then(function (response) {
+                    if (!response.ok) {
+                        throw new Error("table page request failed: " + response.status);
+                    }
+                    return response.json();
+                })
+                .then(function (data) {
+                    self.pages[key] = data;
+                    return data;
+                }, function (error) {
+                    // retried on the next render
+                    delete self.pages[key];
+                    throw error;
+                });
+        }
+        return this.pages[key];
+    };
+
+    ResultsTable.prototype.render = function () {
+        var self = this;
+        var category = this.category.value;
+        var render = ++this.renders;
+
+        var scrolled = Math.max(this.viewport.scrollLeft - NAME_WIDTH, 0);
+        var first = Math.max(Math.floor(scrolled / COLUMN_WIDTH) - OVERSCAN, 0);
+        var last = Math.min(
+            Math.ceil((scrolled + this.viewport.clientWidth) / COLUMN_WIDTH) + OVERSCAN,
+            this.columnCount
+        );
+
+        var pages = [];
+        for (var page = Math.floor(first / this.pageColumns);
+            page * this.pageColumns < Math.max(last, 1); page++) {
+            pages.push(this.page(category, page));
+        }
+
+        Promise.all(pages).then(function (loaded) {
+            // drop renders overtaken by a later scroll or category change
+            if (render === self.renders) {
+                self.draw(loaded, first, last);
+            }
+        }, function (error) {
+            if (render === self.renders) {
+                self.drawError(error);
+            }
+        });
+    };
+
+    ResultsTable.prototype.draw = function (pages, first, last) {
+        var rows = pages[0].rows;
+        var columns = [];
+        var values = [];
+        pages.forEach(function (page) {
+            page.columns.forEach(function (column, i) {
+                var position = page.col_start + i;
+                if (position >= first && position < last) {
+                    columns.push(column);
+                    values.push(page.values[i]);
+                }
+            });
+        });
+
+        var table = document.createElement("table");
+        table.className = this.table.className;
+        table.style.marginLeft = first * COLUMN_WIDTH + "px";
+        table.style.width = NAME_WIDTH + columns.length * COLUMN_WIDTH + "px";
+
+        var header = table.insertRow();
+        header.appendChild(nameCell("th", pages[0].category));
+        columns.forEach(function (column) {
+            var cell = document.createElement("th");
+            cell.textContent = column;
+            header.appendChild(cell);
+        });
+
+        rows.forEach(function (name, row) {
+            var tr = table.insertRow();
+            tr.appendChild(nameCell("td", name));
+            values.forEach(function (column) {
+                tr.insertCell().textContent = column[row] === null ? "" : column[row];
+            });
+        });
+
+        this.table.replaceWith(table);
+        this.table = table;
+    };
+
+    ResultsTable.prototype.drawError = function (error) {
+        var table = document.createElement("table");
+        table.className = this.table.className;
+        table.insertRow().appendChild(
+            nameCell("td", "Couldn't load this part of the table. Scroll to retry.")
+        );
+        console.error(error);
+
+        this.table.replaceWith(table);
+        this.table = table;
+    };
+
+    // the selection as form fields, as the dashboard form submits it
+    function selectionBody(selection) {
+        var body = new URLSearchParams();
+        Object.keys(selection).forEach(function (field) {
+            [].concat(selection[field]).forEach(function (value) {
+                body.append(field, value);
+            });
+        });
+        return body;
+    }
+
+    function nameCell(tag, text) {
+        var cell = document.createElement(tag);
+        cell.className = "results-name";
+        cell.textContent = text;
+        return cell;
+    }
+
+    document.addEventListener("DOMContentLoaded", function () {
+        document.querySelectorAll(".results-table").forEach(function (container) {
+            new ResultsTable(container);
+        });
+    });
+})();
@@ -5,6 +5,7 @@ from wtforms_components._compat import html_escape
 from wtforms_components.fields import SelectMultipleField as _SelectMultipleField
 
 import six
+from functools import lru_cache
 
 
 class SelectTitleWidget(SelectWidget):
@@ -24,9 +25,19 @@ class SelectTitleWidget(SelectWidget):
                 selected = coerce_func(value) == data
 
         if isinstance(value, dict):
-            options = value
+            options = tuple(value.items())
         else:
-            options = {"value": value}
+            options = (("value", value),)
+
+        return cls._render_option_html(options, label, selected)
+
+    @staticmethod
+    @lru_cache(maxsize=16384)
+    def _render_option_html(options, label, selected):
+        # Choices are built once and reused across requests, so rendered
+        # options are cached too. Keyed on the option's full content, so stale
+        # entries are never hit after choices change.
+        options = dict(options)
 
         if selected:
             options["selected"] = True
@@ -0,0 +1,343 @@
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+from census_api import requests, transient_error
+from fetch_engine import CENSUS_API_HOST
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Census api calls per second (and largest burst), shared by every process on
+# the host that calls the census api, app workers and warm_cache.py alike,
+# through sqlite. Processes sharing a bucket must agree on its rate and size
+UPSTREAM_RATE_DB = "rate_limit.db"
+UPSTREAM_RATE = 5
+UPSTREAM_BURST = 20
+
+
+class UpstreamError(Exception):
+    """
+    Raised when a census api call fails after all retries, or isn't attempted
+    because the circuit breaker is open.
+    """
+
+
+class UpstreamTimeout(UpstreamError):
+    """
+    Raised when a census api call (or waiting for the rate limiter) takes
+    longer than the configured timeout.
+    """
+
+
+class RateLimitTimeout(UpstreamTimeout):
+    """
+    Raised when no rate limiter token becomes available within the timeout.
+    The call isn't made, so it isn't retried either.
+    """
+
+
+class CircuitOpen(UpstreamError):
+    """
+    Raised instead of calling the census api while the circuit breaker is open.
+    """
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. The bucket's state is kept in a sqlite database,
+    so every worker process on a host draws from the same bucket and a burst of
+    users can't exceed the api key's quota together.
+
+    args:
+        db_path (str): Path to sqlite database file. Created if missing.
+        rate (float): Tokens added per second, i.e. the sustained call rate
+        capacity (int): Maximum number of tokens, i.e. the largest burst
+        name (str): Bucket name, so several limits can share one database
+    """
+
+    def __init__(self, db_path, rate, capacity, name=CENSUS_API_HOST):
+        self.db_path = db_path
+        self.rate = rate
+        self.capacity = capacity
+        self.name = name
+
+        # transactions are managed explicitly, see _take
+        self.db = sqlite3.connect(
+            db_path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+
+        with self._lock:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS token_buckets (
+                    name text PRIMARY KEY,
+                    tokens real,
+                    updated_at real
+                )
+            """)
+
+    def _take(self):
+        """
+        Takes a token if one is available.
+
+        returns:
+            float: 0 if a token was taken, otherwise seconds until one will be
+        """
+
+        with self._lock:
+            # locks the database for writing, so processes take tokens in turn
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute(
+                    "SELECT tokens, updated_at FROM token_buckets WHERE name == ?",
+                    (self.name,),
+                ).fetchone()
+
+                now = time.time()
+                if row is None:
+                    tokens = self.capacity
+                else:
+                    tokens = min(self.capacity, row[0] + (now - row[1]) * self.rate)
+
+                if tokens >= 1:
+                    tokens -= 1
+                    wait = 0.0
+                else:
+                    wait = (1 - tokens) / self.rate
+
+                self.db.execute(
+                    "INSERT OR REPLACE INTO token_buckets VALUES (?, ?, ?)",
+                    (self.name, tokens, now),
+                )
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+        return wait
+
+    def acquire(self, timeout=None):
+        """
+        Waits for a token.
+
+        args:
+            timeout (float): Maximum seconds to wait. None waits indefinitely.
+        returns:
+            bool: whether a token was taken before the timeout
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if wait == 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+def shared_rate_limiter():
+    """
+    returns:
+        TokenBucket: the census api rate limit shared by all processes on this
+            host
+    """
+    return TokenBucket(UPSTREAM_RATE_DB, rate=UPSTREAM_RATE, capacity=UPSTREAM_BURST)
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing.
+
+    After failure_threshold consecutive failures the breaker opens, and calls
+    fail immediately for reset_timeout seconds. Then a single trial call is let
+    through: if it succeeds the breaker closes again, otherwise it reopens.
+
+    args:
+        failure_threshold (int): Consecutive failures that open the breaker
+        reset_timeout (float): Seconds the breaker stays open
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        returns:
+            str: "closed", "open" or "half_open"
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return "open"
+            return "half_open"
+
+    def allow(self):
+        """
+        returns:
+            bool: whether a call may be made now
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            if self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def release_trial(self):
+        """
+        Ends a trial call that neither succeeded nor failed, e.g. because it
+        never reached the upstream, so the next call can be the trial instead.
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_running:
+                    logger.warning(
+                        "census api circuit breaker opened after %d failures",
+                        self._failures,
+                    )
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class UpstreamGuard:
+    """
+    Wraps census api calls with rate limiting, per-call timeouts, retries with
+    jittered exponential backoff, and a circuit breaker. Together these bound
+    how long a query can wait on the census api: at most about
+    (retries + 1) * timeout + retries * max_backoff seconds, where timeout
+    applies to connecting and to each wait between bytes of a response.
+
+    Only transient failures (network errors, timeouts, 429s and 5xx responses)
+    are retried and count towards opening the breaker. Other errors, e.g. a
+    request for an unknown variable, are raised straight away.
+
+    args:
+        limiter (TokenBucket): Rate limiter. None disables rate limiting.
+        breaker (CircuitBreaker): Circuit breaker. None disables it.
+        timeout (float): Seconds to wait for a rate limiter token, passed on to
+            each call as its timeout keyword argument. None waits indefinitely.
+        retries (int): Retries after a failed call
+        backoff (float): Base backoff in seconds. Retry n waits a random time of
+            up to backoff * 2^n seconds ("full jitter"), so retries from many
+            requests don't arrive in lockstep.
+        max_backoff (float): Maximum backoff in seconds
+        retryable (Callable[[Exception], bool]): Whether a failed call is
+            worth retrying
+    """
+
+    def __init__(
+        self,
+        limiter=None,
+        breaker=None,
+        timeout=30,
+        retries=3,
+        backoff=0.5,
+        max_backoff=8,
+        retryable=transient_error,
+    ):
+        self.limiter = limiter
+        self.breaker = breaker
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retryable = retryable
+
+    def call(self, fn, *args):
+        """
+        Calls fn(*args, timeout=timeout), retrying transient failures.
+
+        returns:
+            fn's return value
+        raises:
+            CircuitOpen: if the circuit breaker is open
+            UpstreamTimeout: if the last attempt timed out
+            UpstreamError: if the last attempt failed with another transient
+                error
+            Exception: whatever fn raised, if it isn't retryable
+        """
+
+        for attempt in range(self.retries + 1):
+            if self.breaker is not None and not self.breaker.allow():
+                raise CircuitOpen("census api circuit breaker is open")
+
+            try:
+                return self._attempt(fn, args)
+            except RateLimitTimeout:
+                raise
+            except Exception as e:
+                if not self.retryable(e):
+                    raise
+                if attempt == self.retries:
+                    if isinstance(e, requests.Timeout):
+                        raise UpstreamTimeout(
+                            f"census api call took over {self.timeout}s"
+                        ) from e
+                    raise UpstreamError(f"census api call failed: {e}") from e
+
+                logger.info(
+                    "census api call failed (attempt %d of %d): %s",
+                    attempt + 1,
+                    self.retries + 1,
+                    e,
+                )
+                with span("retry_backoff"):
+                    time.sleep(
+                        random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                    )
+
+    def _attempt(self, fn, args):
+        """
+        Makes one call, after the breaker allowed it, and reports the outcome to
+        the breaker. Every exit reports to the breaker or releases its trial, so
+        a half open breaker can't be left waiting on a trial that never ends.
+        """
+
+        reported = False
+        try:
+            if self.limiter is not None and not self.limiter.acquire(self.timeout):
+                # not the upstream's fault, so the breaker isn't told
+                raise RateLimitTimeout("timed out waiting for the census api rate limit")
+
+            try:
+                result = fn(*args, timeout=self.timeout)
+            except Exception as e:
+                # errors that aren't the upstream's fault only release the trial
+                if self.breaker is not None and self.retryable(e):
+                    self.breaker.record_failure()
+                    reported = True
+                raise
+
+            if self.breaker is not None:
+                self.breaker.record_success()
+                reported = True
+            return result
+        finally:
+            if self.breaker is not None and not reported:
+                self.breaker.release_trial()
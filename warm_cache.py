@@ -0,0 +1,156 @@
+import argparse
+from concurrent.futures import as_completed
+
+from tqdm import tqdm
+
+from census import CensusViewer, GeoDB, TABLETYPES
+import census_api
+from census_cache import CensusCache
+from fetch_engine import FetchEngine
+from load_config import load_config
+from matrix_store import CountyMatrixStore
+from upstream import UpstreamGuard, shared_rate_limiter
+
+
+def config_vars_by_tabletype(config):
+    """
+    Groups the census api variable ids used in a variable config by table type.
+
+    returns:
+        List[Tuple[str, List[str]]]: tabletype, variable ids pairs
+    """
+
+    all_vars = list(dict.fromkeys(var_id for var in config for var_id in var["vars"]))
+
+    tabletype_vars = []
+    for table_prefix, tabletype in TABLETYPES:
+        vars_ = [var for var in all_vars if var.startswith(table_prefix)]
+        if vars_:
+            tabletype_vars.append((tabletype, vars_))
+    return tabletype_vars
+
+
+def plan_warm_jobs(geo_db, cache, config, src, years):
+    """
+    Lists the downloads needed to cache every configured variable for every
+    state. Variables already in the cache are skipped, so an interrupted run
+    resumes where it stopped, and a rerun only fetches new years or variables.
+
+    returns:
+        List[Tuple[str, int, str, str, List[str]]]: src, year, state fips,
+            tabletype, missing variable ids
+    """
+
+    jobs = []
+    for year in years:
+        for tabletype, vars_ in config_vars_by_tabletype(config):
+            for state in geo_db.get_states():
+                state_fips = geo_db.get_state_fips(state)
+                missing = cache.missing(src, year, state_fips, tabletype, vars_)
+                if missing:
+                    jobs.append((src, year, state_fips, tabletype, missing))
+    return jobs
+
+
+def warm_cache(
+    geo_db,
+    cache,
+    config,
+    api_key,
+    src="acs5",
+    years=(2018,),
+    workers=4,
+    upstream=None,
+):
+    """
+    Downloads every configured variable for all counties in every state into
+    the census cache, with at most `workers` downloads running at once. Each
+    state's result is cached as soon as it arrives.
+
+    Downloads go through upstream (an upstream.UpstreamGuard), so they can share
+    the app's census api rate limit. Defaults to timeouts and retries only.
+
+    returns:
+        int: number of downloads made
+    """
+
+    jobs = plan_warm_jobs(geo_db, cache, config, src, years)
+    if not jobs:
+        return 0
+
+    if upstream is None:
+        upstream = UpstreamGuard()
+
+    engine = FetchEngine(max_workers=workers, per_host_limit=workers)
+    census_api.configure(pool_size=workers)
+    try:
+        futures = {
+            engine.submit(
+                upstream.call,
+                CensusViewer._build_state_dataframe,
+                state_fips,
+                missing,
+                src,
+                year,
+                tabletype,
+                api_key,
+            ): (src, year, state_fips, tabletype)
+            for src, year, state_fips, tabletype, missing in jobs
+        }
+
+        for future in tqdm(
+            as_completed(futures), total=len(futures), desc="Warming census cache"
+        ):
+            src_, year, _, tabletype = futures[future]
+            state_fips, state_data = future.result()
+            cache.put(src_, year, state_fips, tabletype, state_data)
+    finally:
+        engine.shutdown()
+
+    return len(jobs)
+
+
+if __name__ == "__main__":
+    import secrets
+
+    parser = argparse.ArgumentParser(
+        description="Pre-download all variables in vars.json for all counties"
+    )
+    parser.add_argument("--src", default="acs5")
+    parser.add_argument("--years", type=int, nargs="+", default=[2018])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--cache", default="census_cache.db")
+    parser.add_argument(
+        "--matrix",
+        action="store_true",
+        help="Also write a memory mapped county_matrix_<src>_<year> store per year",
+    )
+    args = parser.parse_args()
+
+    geo_db = GeoDB("geos.db")
+    cache = CensusCache(args.cache)
+    config = load_config("vars.json")
+
+    warm_cache(
+        geo_db,
+        cache,
+        config,
+        secrets.census_key,
+        src=args.src,
+        years=args.years,
+        workers=args.workers,
+        # same rate limit as the app, so warming the cache next to a running
+        # app doesn't exceed the api key's quota
+        upstream=UpstreamGuard(limiter=shared_rate_limiter()),
+    )
+
+    if args.matrix:
+        for year in args.years:
+            CountyMatrixStore.build(
+                f"county_matrix_{args.src}_{year}",
+                cache,
+                geo_db,
+                args.src,
+                year,
+                config_vars_by_tabletype(config),
+            )